@@ -1,7 +1,38 @@
-from typing import List, Any, Optional, Dict, Union, Literal
-from dataclasses import dataclass
+from typing import List, Any, Optional, Dict, Union, Literal, Iterator, Callable, Tuple, Set, Type, Iterable, IO
+from dataclasses import dataclass, field, asdict, replace
 from enum import Enum
 from datetime import datetime
+from abc import ABC, abstractmethod
+from itertools import islice, repeat, chain, groupby
+from collections import OrderedDict, deque
+from statistics import NormalDist
+from operator import itemgetter
+from bisect import bisect_left, bisect_right, insort
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import pickle
+import random
+import re
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError: # Columnar filtering falls back to plain Python loops
+    np = None
 
 class SQLDataType(Enum):
     INT = "INT"
@@ -13,15 +44,88 @@ class SQLDataType(Enum):
     DATE = "DATE"
     BIGINT = "BIGINT"
 
+BIGINT_MIN, BIGINT_MAX = -2 ** 63, 2 ** 63 - 1 # Range of the 64-bit integers INT and BIGINT columns are stored as
+
+def is_bigint(value: str) -> bool:
+    # Fewer than 19 digits always fit, so only the longer values are converted
+    return value.isascii() and value.isdigit() and (len(value) < 19 or int(value) <= BIGINT_MAX)
+
+def out_of_range(column: 'Column', value: Any) -> Optional[str]:
+    """Error message when a converted INT or BIGINT value doesn't fit in 64 bits, None otherwise"""
+    if column.data_type in (SQLDataType.INT, SQLDataType.BIGINT) and value is not None and not BIGINT_MIN <= value <= BIGINT_MAX:
+        return f"Value {value} is out of range for {column.data_type.value} column {column.name}"
+    return None
+
 validators = {
-    SQLDataType.BIGINT: lambda v: v.isdigit(),
-    SQLDataType.INT: lambda v: v.isdigit(),
+    SQLDataType.BIGINT: is_bigint,
+    SQLDataType.INT: is_bigint,
     SQLDataType.BOOLEAN: lambda v: v.upper() in ("TRUE", "FALSE"),
     SQLDataType.FLOAT: lambda v: v.replace(".", "", 1).isdigit(),
     SQLDataType.DECIMAL: lambda v: v.replace(".", "", 1).isdigit()
 }
+
+converters = {
+    SQLDataType.BIGINT: int,
+    SQLDataType.INT: int,
+    SQLDataType.BOOLEAN: lambda v: v if isinstance(v, bool) else str(v).upper() == "TRUE",
+    SQLDataType.FLOAT: float,
+    SQLDataType.DECIMAL: float
+}
+
+def convert_value(value: Any, data_type: SQLDataType) -> Any:
+    """Convert a stored value to the Python type of its column (types without a converter stay as they are)"""
+    if value is None or data_type not in converters:
+        return value
+    return converters[data_type](value)
+
+def like_to_regex(pattern: str) -> 're.Pattern[str]':
+    """Translate a SQL LIKE pattern (% and _ wildcards) into a regular expression"""
+    parts = (".*" if char == "%" else "." if char == "_" else re.escape(char) for char in pattern)
+    return re.compile("".join(parts), re.DOTALL)
+
+# Python expression of every WHERE operator, {value} is the stored value and {expected} the prepared one
+condition_templates: Dict[str, str] = {
+    '=': "{value} == {expected}",
+    '>': "{value} > {expected}",
+    '<': "{value} < {expected}",
+    '>=': "{value} >= {expected}",
+    '<=': "{value} <= {expected}",
+    'LIKE': "{expected}.fullmatch(str({value})) is not None",
+    'IN': "{value} in {expected}"
+}
+
+def prepare_expected(operator: str, expected: Any) -> Any:
+    """Prepare an expected value once per query: a set for IN and a compiled regular expression for LIKE"""
+    if operator == "LIKE":
+        return like_to_regex(str(expected))
+    if operator == "IN":
+        try:
+            return frozenset(expected)
+        except TypeError:
+            return tuple(expected)
+    return expected
+
+def compile_condition(operator: str, expected: Any) -> Callable[[Any], bool]:
+    """Test of a single non NULL value against one WHERE condition"""
+    expression = condition_templates[operator].format(value="value", expected="expected")
+    return eval(f"lambda value: {expression}", {"expected": prepare_expected(operator, expected)})
+
+def compile_predicate(conditions: List[Tuple[str, str, Any]]) -> Callable[[Dict[str, Any]], bool]:
+    """
+    Generate one function testing a record against every (field, operator, value) condition,
+    so a query doesn't look up an operator and call a comparator per condition and record.
+    A NULL value never matches
+    """
+    namespace: Dict[str, Any] = {}
+    tests: List[str] = []
+    for position, (field, operator, expected) in enumerate(conditions):
+        namespace[f"expected_{position}"] = prepare_expected(operator, expected)
+        value = f"value_{position}"
+        test = condition_templates[operator].format(value=value, expected=f"expected_{position}")
+        tests.append(f"(({value} := record.get({field!r})) is not None and {test})")
+    return eval(f"lambda record: {' and '.join(tests) or 'True'}", namespace)
     
-@dataclass
+@dataclass(slots=True)
 class Column:
     """Represents a database column with its properties"""
     name: str
@@ -32,17 +136,20 @@ class Column:
     not_null: bool = False
     unique: bool = False
     
-@dataclass    
+@dataclass(slots=True)
 class ForeignKey:
     """Represents a foreign key column in the database"""
     name: str
     reference_table_name: str
     reference_column_name: str
+    data_type: Optional[SQLDataType] = None # Type of the referenced column, the values are stored as it
     
 class ColumnRepository:
     def __init__(self) -> None:
         self._columns: List[Column] = []
         self._foreign_keys: List[ForeignKey] = []
+        self._by_name: Dict[str, Union[Column, ForeignKey]] = {} # Every column and foreign key, kept in step with the lists
+        self.version = 0 # Increased on every schema change
         
     @property
     def columns(self):
@@ -51,6 +158,29 @@ class ColumnRepository:
     @property
     def foreign_keys(self):
         return self._foreign_keys
+    
+    def __contains__(self, name: str) -> bool:
+        """Whether a column or foreign key has this name"""
+        return name in self._by_name
+    
+    def column(self, name: str) -> Optional[Column]:
+        """The column with this name, None if there is none (or it's a foreign key)"""
+        found = self._by_name.get(name)
+        return found if isinstance(found, Column) else None
+    
+    def foreign_key(self, name: str) -> Optional[ForeignKey]:
+        found = self._by_name.get(name)
+        return found if isinstance(found, ForeignKey) else None
+    
+    def data_type(self, name: str) -> Optional[SQLDataType]:
+        """Data type of a column or of the column a foreign key references, None for a name that isn't one"""
+        found = self._by_name.get(name)
+        return found.data_type if found is not None else None
+    
+    @property
+    def names(self) -> List[str]:
+        """Every column name, then every foreign key name"""
+        return [column.name for column in self._columns] + [key.name for key in self._foreign_keys]
         
     def _validate_auto_increment(self, column: Column) -> None:
         """Validate auto increment constraints"""
@@ -100,7 +230,7 @@ class ColumnRepository:
             ValueError: If column validation fails
         """
         
-        if name in [column.name for column in self._columns] or name in [key.name for key in self._foreign_keys]:
+        if name in self._by_name:
             raise ValueError(f"Column '{name}' already exists in table")
         
         if isinstance(data_type, str):
@@ -125,13 +255,17 @@ class ColumnRepository:
         self._validate_default_value(column)
         
         self._columns.append(column)
+        self._by_name[name] = column
+        self.version += 1
         return self
     
     def remove_column(self, column_name: str) -> bool:
-        found_column = next((column for column in self._columns if column.name == column_name), None)
+        found_column = self.column(column_name)
         
         if found_column:
             self._columns.remove(found_column)
+            del self._by_name[column_name]
+            self.version += 1
             return True
         
         print("Column doesn't exist")
@@ -141,31 +275,67 @@ class ColumnRepository:
         self,
         name: str,
         reference_table_name: str,
-        reference_column_name: str
+        reference_column_name: str,
+        data_type: Optional[Union[SQLDataType, str]] = None
     ) -> 'ColumnRepository':
         """
         Add a foreign key constraint. Returns self for method chaining.
+        data_type is the type of the referenced column, which the values of the key are converted to
         """
         
-        if name in [column.name for column in self._columns] or name in [key.name for key in self._foreign_keys]:
+        if name in self._by_name:
             raise ValueError(f"Column '{name}' already exists in table")
         
-        fk = ForeignKey(name, reference_table_name, reference_column_name)
+        if isinstance(data_type, str):
+            data_type = SQLDataType(data_type.upper())
+        fk = ForeignKey(name, reference_table_name, reference_column_name, data_type)
         self._foreign_keys.append(fk)
+        self._by_name[name] = fk
+        self.version += 1
         return self
     
     def remove_foreign_key(self, key_name: str) -> bool:
-        found_key = next((key for key in self._foreign_keys if key.name == key_name), None)
+        found_key = self.foreign_key(key_name)
         
         if found_key:
             self._foreign_keys.remove(found_key)
+            del self._by_name[key_name]
+            self.version += 1
             return True
         
         print("Foreign key doesn't exist")
         return False 
     
+class RowLayout:
+    """Position of every column in the value tuple of a row"""
+    __slots__ = ("names", "positions")
+    
+    def __init__(self, names: Tuple[str, ...]) -> None:
+        self.names = names
+        self.positions = {name: position for position, name in enumerate(names)}
+        
+class RowLayouts(dict):
+    """The layouts of a repository by column names, so all the rows with the same columns share one"""
+    def __missing__(self, names: Tuple[str, ...]) -> RowLayout:
+        layout = self[names] = RowLayout(names)
+        return layout
+    
 class Row:
-    def __init__(self, columns: List[Column], foreign_keys: List[ForeignKey], values: Dict[str, Any]) -> None:
+    """
+    A tuple of values plus the layout mapping column names to positions in it.
+    The layout is shared, so a row costs little more than its values
+    Example: Row(columns, foreign_keys, {"id": 1, "name": "Alice"}).get("name")
+    Results: 'Alice'
+    """
+    __slots__ = ("_layout", "_data", "row_id")
+    
+    def __init__(
+        self,
+        columns: List[Column],
+        foreign_keys: List[ForeignKey],
+        values: Dict[str, Any],
+        layout: Optional[RowLayout] = None
+    ) -> None:
        # Get required column names from not_null columns and foreign keys
         required_columns = [column.name for column in columns 
                           if column.not_null and column.default_value is None]
@@ -184,12 +354,32 @@ class Row:
                 value = values[column.name]
                 if not self._validate_type(value, column.data_type):
                     raise ValueError(f"Invalid type for column {column.name}: expected {column.data_type.value}")
+        for key in foreign_keys:
+            if key.data_type is not None and not self._validate_type(values[key.name], key.data_type):
+                raise ValueError(f"Invalid type for column {key.name}: expected {key.data_type.value}")
         
-        self._values = values
+        # layout has to list the keys of values in their order
+        self._layout = layout if layout is not None else RowLayout(tuple(values))
+        self._data = tuple(values.values())
+        self.row_id: Optional[int] = None # Position of the row in its repository, assigned when it is stored
+        
+    @classmethod
+    def _from_storage(cls, data: Tuple[Any, ...], row_id: int, layout: RowLayout) -> 'Row':
+        """Build a row from values that were already validated when they were stored"""
+        row = cls.__new__(cls)
+        row._layout = layout
+        row._data = data
+        row.row_id = row_id
+        return row
         
     @property
-    def values(self):
-        return self._values
+    def values(self) -> Dict[str, Any]:
+        """The values by column name, built on every call (use get for a single value)"""
+        return dict(zip(self._layout.names, self._data))
+    
+    def get(self, name: str, default: Any = None) -> Any:
+        position = self._layout.positions.get(name)
+        return default if position is None else self._data[position]
     
     def _validate_type(self, value: Any, data_type: SQLDataType) -> bool:
         if value is None:
@@ -208,490 +398,4140 @@ class Row:
         
         return True
 
+class UniqueConstraints:
+    """
+    Keeps a hash set with the stored values of every UNIQUE and PRIMARY KEY column,
+    so a duplicate is found in O(1) instead of scanning the stored rows. NULLs are never duplicates
+    """
+    def __init__(self, stored_rows: Callable[[], Iterator[Row]]) -> None:
+        self._stored_rows = stored_rows
+        self._values: Dict[str, Set[Any]] = {}
+        self._data_types: Dict[str, SQLDataType] = {}
+        
+    def constrained_columns(self, columns: List[Column]) -> List[Column]:
+        constrained = [column for column in columns if column.unique or column.is_pk]
+        
+        # Forget the sets of columns that were removed or lost their constraint
+        names = {column.name for column in constrained}
+        for name in [name for name in self._values if name not in names]:
+            del self._values[name]
+            del self._data_types[name]
+        return constrained
+    
+    def _values_of(self, column: Column) -> Set[Any]:
+        values = self._values.get(column.name)
+        if values is None:
+            # First use of the constraint, so collect the values stored before it existed
+            values = {convert_value(row.get(column.name), column.data_type) for row in self._stored_rows()}
+            values.discard(None)
+            self._values[column.name] = values
+            self._data_types[column.name] = column.data_type
+        return values
+    
+    def find_duplicate(self, values: Dict[str, Any], constrained: List[Column]) -> Optional[str]:
+        """Describe the first constrained value that is already stored, if any"""
+        for column in constrained:
+            value = convert_value(values.get(column.name), column.data_type)
+            constraint = "PRIMARY KEY" if column.is_pk else "UNIQUE"
+            try:
+                is_duplicate = value is not None and value in self._values_of(column)
+            except TypeError:
+                return f"Unhashable value '{value}' for {constraint} column {column.name}"
+            if is_duplicate:
+                return f"Duplicate value '{value}' for {constraint} column {column.name}"
+        return None
+    
+    def check(self, values: Dict[str, Any], columns: List[Column]) -> None:
+        """Raise a ValueError if a constrained value is already stored"""
+        duplicate = self.find_duplicate(values, self.constrained_columns(columns))
+        if duplicate:
+            print(duplicate)
+            raise ValueError(duplicate)
+            
+    def add_constrained(self, values: Dict[str, Any], constrained: List[Column]) -> None:
+        for column in constrained:
+            value = convert_value(values.get(column.name), column.data_type)
+            if value is not None:
+                self._values_of(column).add(value)
+                
+    def add(self, values: Dict[str, Any], columns: List[Column]) -> None:
+        self.add_constrained(values, self.constrained_columns(columns))
+                
+    def discard(self, values: Dict[str, Any]) -> None:
+        for name, stored_values in self._values.items():
+            stored_values.discard(convert_value(values.get(name), self._data_types[name]))
+
+class BatchValidator:
+    """
+    Checks a batch of rows one column at a time. The schema rules are prepared once
+    instead of being re-derived in Row.__init__ for every row, and every distinct
+    value of a column is only validated once per batch
+    """
+    def __init__(self, columns: List[Column], foreign_keys: List[ForeignKey]) -> None:
+        self.required = [column.name for column in columns if column.not_null and column.default_value is None]
+        self.required += [key.name for key in foreign_keys]
+        self.typed = [(column.name, column.data_type) for column in columns if column.data_type in validators]
+        self.typed += [(key.name, key.data_type) for key in foreign_keys if key.data_type in validators]
+        
+    def validate(self, batch: List[Dict[str, Any]]) -> Dict[int, str]:
+        """Error messages of the invalid rows, by their position in the batch"""
+        missing: Dict[int, List[str]] = {}
+        for name in self.required:
+            for position, values in enumerate(batch):
+                if values.get(name) is None:
+                    missing.setdefault(position, []).append(name)
+        errors = {
+            position: f"Missing required values for columns: {', '.join(names)}"
+            for position, names in missing.items()
+        }
+        
+        for name, data_type in self.typed:
+            validator = validators[data_type]
+            checked: Dict[Tuple[type, Any], bool] = {}
+            for position, values in enumerate(batch):
+                value = values.get(name)
+                if value is None or position in errors:
+                    continue
+                # The type is part of the key so that True and 1 are validated separately
+                key = (type(value), value)
+                try:
+                    is_valid = checked.get(key)
+                    if is_valid is None:
+                        is_valid = checked[key] = validator(str(value))
+                except TypeError:
+                    # Lists and dicts can't be cached, they are checked on their own
+                    is_valid = validator(str(value))
+                if not is_valid:
+                    errors[position] = f"Invalid type for column {name}: expected {data_type.value}"
+        return errors
+
 class RowRepository:
     def __init__(self) -> None:
-        self._rows: List[Row] = []
+        # Removed rows leave a None behind, so the position of a row stays its id
+        self._rows: List[Optional[Row]] = []
+        self._removed_count = 0
+        self._layouts = RowLayouts()
+        self._constraints = UniqueConstraints(lambda: self.rows)
         
-    def add_row(self, values: Dict[str, Any], columns: List[Column], foreign_keys: List[ForeignKey]) -> bool:
+    def add_row(self, values: Dict[str, Any], columns: List[Column], foreign_keys: List[ForeignKey]) -> Optional[Row]:
         try:
-            new_row = Row(columns, foreign_keys, values)
-            self._rows.append(new_row)
-            return True
+            new_row = Row(columns, foreign_keys, values, self._layouts[tuple(values)])
+            self._constraints.check(values, columns)
         except:
             print(f"Failed to create a row with values: {values}")
-            return False
+            return None
+        
+        self._constraints.add(values, columns)
+        new_row.row_id = len(self._rows)
+        self._rows.append(new_row)
+        return new_row
+    
+    def add_rows(
+        self,
+        batch: List[Dict[str, Any]],
+        columns: List[Column],
+        foreign_keys: List[ForeignKey]
+    ) -> Tuple[List[Row], Dict[int, str]]:
+        """Validate and store a batch of rows. Returns the stored rows and the errors of the others by position"""
+        errors = BatchValidator(columns, foreign_keys).validate(batch)
+        constrained = self._constraints.constrained_columns(columns)
+        stored: List[Row] = []
+        
+        for position, values in enumerate(batch):
+            if position in errors:
+                continue
+            duplicate = self._constraints.find_duplicate(values, constrained)
+            if duplicate:
+                errors[position] = duplicate
+                continue
+            
+            self._constraints.add_constrained(values, constrained)
+            new_row = Row._from_storage(tuple(values.values()), len(self._rows), self._layouts[tuple(values)])
+            self._rows.append(new_row)
+            stored.append(new_row)
+        return stored, errors
         
     def remove_row(self, row: Row) -> bool:
-        if row in self._rows:
-            self._rows.remove(row)
+        if row.row_id is not None and row.row_id < len(self._rows) and self._rows[row.row_id] is row:
+            self._rows[row.row_id] = None
+            self._removed_count += 1
+            self._constraints.discard(row.values)
             return True
         
         print("Row doesn't exist")
         return False
-
-class Table:
-    def __init__(self, table_name: str, column_repository: ColumnRepository, row_repository: RowRepository) -> None:
-        self.table_name: str = table_name
-        self.column_repository = column_repository
-        self.row_repository = row_repository
+    
+    @property
+    def rows(self) -> Iterator[Row]:
+        return (row for row in self._rows if row is not None)
+    
+    def __len__(self) -> int:
+        return len(self._rows) - self._removed_count
+    
+    @property
+    def next_row_id(self) -> int:
+        """Id the next stored row gets, every stored row has a smaller one"""
+        return len(self._rows)
+    
+    def _fields(self, layout: RowLayout, columns: List[Column], foreign_keys: List[ForeignKey]) -> List[Tuple[str, Optional[int], Optional[SQLDataType]]]:
+        """(name, position in the row, data type) of every record field, for the rows of a layout"""
+        fields = [(column.name, layout.positions.get(column.name), column.data_type) for column in columns]
+        fields.extend((key.name, layout.positions.get(key.name), key.data_type) for key in foreign_keys)
+        return fields
+    
+    def _to_record(self, row: Row, fields: List[Tuple[str, Optional[int], Optional[SQLDataType]]]) -> Dict[str, Any]:
+        data = row._data
+        return {name: None if position is None else convert_value(data[position], data_type) for name, position, data_type in fields}
+    
+    def records(
+        self,
+        columns: List[Column],
+        foreign_keys: List[ForeignKey],
+        conditions: Optional[List[Tuple[str, str, Any]]] = None,
+        row_ids: Optional[Union[range, List[int]]] = None,
+        encoded: Optional[Dict[str, Callable[[Iterable[int]], Iterator[Optional[int]]]]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the stored rows matching the conditions as records with values converted to the Python type of their column.
+        row_ids limits the scan to a partition or a sample of the rows. Rows store plain values, so encoded is ignored
+        """
+        if row_ids is None:
+            rows: List[Optional[Row]] = self._rows
+        elif isinstance(row_ids, range):
+            rows = self._rows[row_ids.start:row_ids.stop]
+        else:
+            rows = [self._rows[row_id] for row_id in row_ids]
+        # Positions are looked up once per layout instead of once per value
+        fields: Dict[RowLayout, List[Tuple[str, Optional[int], Optional[SQLDataType]]]] = {}
         
-    def add_column(
+        def to_record(row: Row) -> Dict[str, Any]:
+            layout_fields = fields.get(row._layout)
+            if layout_fields is None:
+                layout_fields = fields[row._layout] = self._fields(row._layout, columns, foreign_keys)
+            return self._to_record(row, layout_fields)
+        
+        records = (to_record(row) for row in rows if row is not None)
+        if conditions:
+            records = filter(compile_predicate(conditions), records)
+        yield from records
+            
+    def record(self, row_id: int, columns: List[Column], foreign_keys: List[ForeignKey]) -> Dict[str, Any]:
+        """Get a single stored row as a record"""
+        row = self._rows[row_id]
+        return self._to_record(row, self._fields(row._layout, columns, foreign_keys))
+    
+    def row(self, row_id: int) -> Optional[Row]:
+        """The stored row with this id, None if it was removed"""
+        return self._rows[row_id] if row_id < len(self._rows) else None
+    
+    def dictionary(self, name: str) -> Optional[List[str]]:
+        """Rows store plain values, no column is dictionary encoded"""
+        return None
+    
+    def code_readers(self, names: Set[str]) -> Dict[str, Callable[[Iterable[int]], Iterator[Optional[int]]]]:
+        return {}
+    
+    def column_values(
         self,
         name: str,
-        data_type: Union[SQLDataType, str],
-        default_value: Optional[Any] = None,
-        is_pk: bool = False,
-        auto_increment: bool = False,
-        not_null: bool = False,
-        unique: bool = False    
-    ) -> 'Table':
-        try:
-            self.column_repository.add_column(
-                name=name,
-                data_type=data_type,
-                default_value=default_value,
-                is_pk=is_pk,
-                auto_increment=auto_increment,
-                not_null=not_null,
-                unique=unique
-            )
-        except Exception as error:
-            print(f"Something went wrong: {error}")
+        data_type: Optional[SQLDataType] = None,
+        row_ids: Optional[Iterable[int]] = None
+    ) -> Iterator[Tuple[int, Any]]:
+        """(row id, converted value) of one column for every stored row, or for those of row_ids"""
+        rows = enumerate(self._rows) if row_ids is None else ((row_id, self._rows[row_id]) for row_id in row_ids)
+        for row_id, row in rows:
+            if row is not None:
+                yield row_id, convert_value(row.get(name), data_type)
             
-        return self
+    def memory_usage(self) -> int:
+        """Approximate number of bytes held by the stored rows"""
+        total = sys.getsizeof(self._rows)
+        total += sum(sys.getsizeof(layout.positions) for layout in self._layouts.values())
+        for row in self.rows:
+            total += sys.getsizeof(row) + sys.getsizeof(row._data)
+            total += sum(sys.getsizeof(value) for value in row._data)
+        return total
     
-    def remove_column(self, column_name: str) -> 'Table':
-        valid_columns = [col.name for col in self.column_repository.columns]
+    @classmethod
+    def from_columnar(cls, repository: 'ColumnarRowRepository') -> 'RowRepository':
+        """The rows of a columnar repository with the same ids, used to open a saved row store"""
+        copy = cls()
+        copy._rows = [None] * repository.next_row_id
+        for row in repository.rows:
+            copy._rows[row.row_id] = Row._from_storage(row._data, row.row_id, copy._layouts[row._layout.names])
+        copy._removed_count = repository.next_row_id - len(repository)
+        return copy
+
+buffer_typecodes = {
+    SQLDataType.BIGINT: "q",
+    SQLDataType.INT: "q",
+    SQLDataType.BOOLEAN: "b",
+    SQLDataType.FLOAT: "d",
+    SQLDataType.DECIMAL: "d"
+}
+
+class ColumnBuffer(ABC):
+    """Stores the values of a single column for every row of a columnar repository"""
+    kind: str
+    _part_names: Tuple[str, ...] = ("nulls",) # Arrays holding the buffer, each stored in the attribute _<name>
+    _is_mapped = False
+    
+    def __init__(self) -> None:
+        self._nulls = bytearray() # 1 for every row where the value is NULL
         
-        if column_name not in valid_columns:
-            print(f"Invalid column name. Must be one of: {', '.join(valid_columns)}")
-            return self
+    @abstractmethod
+    def _append_value(self, value: Any) -> None:
+        pass
+    
+    @abstractmethod
+    def _get_value(self, index: int) -> Any:
+        pass
+    
+    @abstractmethod
+    def nbytes(self) -> int:
+        pass
+    
+    def append(self, value: Any) -> None:
+        if self._is_mapped:
+            self._unmap()
+        self._nulls.append(value is None)
+        self._append_value(value)
         
-        self.column_repository.remove_column(column_name)
-        return self
+    def extend(self, values: List[Any]) -> None:
+        for value in values:
+            self.append(value)
+            
+    def get(self, index: int) -> Any:
+        return None if self._nulls[index] else self._get_value(index)
     
-    def add_foreign_key(
-        self,
-        name: str,
-        reference_table: 'Table',
-        reference_column_name: str
-    ) -> 'Table':
-        found_reference = next((col for col in reference_table.column_repository.columns if col.name == reference_column_name), None)
+    def __len__(self) -> int:
+        return len(self._nulls)
+    
+    def __iter__(self) -> Iterator[Any]:
+        return self.values(range(len(self._nulls)))
+    
+    def values(self, row_ids: Iterable[int]) -> Iterator[Any]:
+        for index in row_ids:
+            yield self.get(index)
+            
+    def select(self, operator: str, expected: Any, row_ids: Iterable[int]) -> List[int]:
+        """Row ids among the given ones whose value matches a WHERE condition"""
+        test = compile_condition(operator, expected)
+        nulls = self._nulls
+        get_value = self._get_value
+        return [row_id for row_id in row_ids if not nulls[row_id] and test(get_value(row_id))]
+    
+    def mask(self, operator: str, expected: Any, row_ids: range) -> Optional[Any]:
+        """NumPy mask of the rows of a range matching a WHERE condition, None when it can't be computed in one go"""
+        return None
+    
+    def parts(self) -> Dict[str, Any]:
+        """The arrays holding the buffer, written as they are in memory to its column file"""
+        return {name: getattr(self, f"_{name}") for name in self._part_names}
+    
+    def header(self) -> Dict[str, Any]:
+        """What else is needed to read the buffer back, kept in the table metadata"""
+        return {}
+    
+    def map(self, parts: Dict[str, memoryview], header: Dict[str, Any]) -> None:
+        """Read the arrays straight from a memory-mapped column file, until the buffer is first modified"""
+        for name, view in parts.items():
+            setattr(self, f"_{name}", view)
+        self._is_mapped = True
         
-        if found_reference:
-            try:
-                self.column_repository.add_foreign_key(name, reference_table.table_name, reference_column_name)
-            except Exception as error:
-                print(f"Something went wrong: {error}")
-        else:
-            print(f"{reference_column_name} doesn't exist in the {reference_table.table_name} table")
+    def _unmap(self) -> None:
+        """Copy the mapped arrays to memory, so that they can grow"""
+        for name in self._part_names:
+            view = getattr(self, f"_{name}")
+            if view.format == "B":
+                setattr(self, f"_{name}", bytearray(view))
+            else:
+                copy = array(view.format)
+                copy.frombytes(view.cast("B"))
+                setattr(self, f"_{name}", copy)
+        self._is_mapped = False
+    
+class NumericColumnBuffer(ColumnBuffer):
+    """Typed array for INT, BIGINT, FLOAT, DECIMAL and BOOLEAN columns"""
+    kind = "numeric"
+    _part_names = ("nulls", "values")
+    
+    def __init__(self, data_type: SQLDataType) -> None:
+        super().__init__()
+        self.data_type = data_type
+        self._values = array(buffer_typecodes[data_type])
         
-        return self
+    def _append_value(self, value: Any) -> None:
+        self._values.append(0 if value is None else value)
+        
+    def extend(self, values: List[Any]) -> None:
+        if self._is_mapped:
+            self._unmap()
+        self._nulls.extend(value is None for value in values)
+        self._values.extend(0 if value is None else value for value in values)
+        
+    def _get_value(self, index: int) -> Any:
+        value = self._values[index]
+        return bool(value) if self.data_type == SQLDataType.BOOLEAN else value
     
-    def remove_foreign_key(self, key_name: str) -> 'Table':
+    def nbytes(self) -> int:
+        return self._values.itemsize * len(self._values) + len(self._nulls)
+    
+    def mask(self, operator: str, expected: Any, row_ids: range) -> Optional[Any]:
+        if np is None or operator == "LIKE" or not row_ids:
+            return None
+        # The views are dropped before returning: the array can't grow while NumPy reads its memory
+        values = np.frombuffer(self._values, dtype=buffer_typecodes[self.data_type])[row_ids.start:row_ids.stop]
+        nulls = np.frombuffer(self._nulls, dtype=np.bool_)[row_ids.start:row_ids.stop]
         try:
-            self.column_repository.remove_foreign_key(key_name)
-        except Exception as error:
-            print(f"Something went wrong: {error}")
+            if operator == "IN":
+                matches = np.isin(values, list(expected))
+            else:
+                matches = {
+                    "=": np.equal, ">": np.greater, "<": np.less, ">=": np.greater_equal, "<=": np.less_equal
+                }[operator](values, expected)
+            if not isinstance(matches, np.ndarray) or matches.dtype != np.bool_:
+                return None
+            return matches & ~nulls
+        except (TypeError, ValueError):
+            return None
         
-        return self
+    def header(self) -> Dict[str, Any]:
+        return {"data_type": self.data_type.value}
     
-    def add_row(self, values: Dict[str, Any]) -> 'Table':
-        self.row_repository.add_row(values, self.column_repository.columns, self.column_repository.foreign_keys)
+class TextColumnBuffer(ColumnBuffer):
+    """UTF-8 bytes of every value in one buffer, plus the offset where each value ends"""
+    kind = "text"
+    _part_names = ("nulls", "offsets", "data")
+    
+    def __init__(self) -> None:
+        super().__init__()
+        self._offsets = array("q", [0])
+        self._data = bytearray()
         
-        return self
+    def _append_value(self, value: Any) -> None:
+        if value is not None:
+            self._data.extend(str(value).encode("utf-8"))
+        self._offsets.append(len(self._data))
+        
+    def _get_value(self, index: int) -> Any:
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], "utf-8")
     
-    def remove_row(self, row: Row) -> 'Table':
-        self.row_repository.remove_row(row)
+    def nbytes(self) -> int:
+        return self._offsets.itemsize * len(self._offsets) + len(self._data) + len(self._nulls)
+    
+DICTIONARY_MAX_SIZE = 1024 # Distinct values a TEXT column can have and still be dictionary encoded
+
+class DictionaryColumnBuffer(ColumnBuffer):
+    """
+    Low-cardinality TEXT column stored as a small integer code per row plus the list of distinct values.
+    Conditions are evaluated once per distinct value and then matched on the codes
+    """
+    kind = "dictionary"
+    _part_names = ("nulls", "codes")
+    
+    def __init__(self) -> None:
+        super().__init__()
+        self._codes = array("H")
+        self.dictionary: List[str] = []
+        self._code_of: Dict[str, int] = {}
         
-        return self
+    def _append_value(self, value: Any) -> None:
+        if value is None:
+            self._codes.append(0)
+            return
+        
+        value = str(value)
+        code = self._code_of.get(value)
+        if code is None:
+            if len(self.dictionary) == DICTIONARY_MAX_SIZE:
+                # One distinct value too many, the column is stored as plain text from now on
+                self._switch_to_text()
+                self._append_value(value)
+                return
+            code = self._code_of[value] = len(self.dictionary)
+            self.dictionary.append(value)
+        self._codes.append(code)
+        
+    def _switch_to_text(self) -> None:
+        """
+        Turn this buffer into a TextColumnBuffer with the same values. It is changed in place,
+        so the repository and every append or extend in progress keep using the same object
+        """
+        nulls, codes, dictionary = self._nulls, self._codes, self.dictionary
+        del self._codes, self.dictionary, self._code_of
+        self.__class__ = TextColumnBuffer
+        self._offsets = array("q", [0])
+        self._data = bytearray()
+        # The value being appended already has its NULL flag, but no code yet
+        for index, code in enumerate(codes):
+            self._append_value(None if nulls[index] else dictionary[code])
+        
+    def _get_value(self, index: int) -> Any:
+        return self.dictionary[self._codes[index]]
     
-    def _format_column(self, column: Column) -> str:
-        """Format a column definition as SQL"""
-        parts = [
-            column.name,
-            column.data_type.value
-        ]
+    def code_reader(self) -> Callable[[Iterable[int]], Iterator[Optional[int]]]:
+        """
+        Reads the codes of rows from the arrays as they are now, so a scan that opened with it
+        keeps reading codes once the buffer switched to plain text
+        """
+        nulls = self._nulls
+        codes = self._codes
         
-        if column.default_value is not None:
-            parts.append(f"DEFAULT {column.default_value}")
-        if column.is_pk:
-            parts.append("PRIMARY KEY")
-        if column.auto_increment:
-            parts.append("AUTO_INCREMENT")
-        if column.not_null:
-            parts.append("NOT NULL")
-        if column.unique:
-            parts.append("UNIQUE")
+        def read(row_ids: Iterable[int]) -> Iterator[Optional[int]]:
+            for index in row_ids:
+                yield None if nulls[index] else codes[index]
+        return read
             
-        return " ".join(parts)
+    def _matching_codes(self, operator: str, expected: Any) -> List[int]:
+        test = compile_condition(operator, expected)
+        return [code for code, value in enumerate(self.dictionary) if test(value)]
     
-    def _format_foreign_key(self, foreign_key: ForeignKey) -> str:
-        """Format a foreign key"""
-        return f"FOREIGN KEY ({foreign_key.name}) REFERENCES {foreign_key.reference_table_name}({foreign_key.reference_column_name})"
+    def select(self, operator: str, expected: Any, row_ids: Iterable[int]) -> List[int]:
+        matching = set(self._matching_codes(operator, expected))
+        nulls = self._nulls
+        codes = self._codes
+        return [row_id for row_id in row_ids if not nulls[row_id] and codes[row_id] in matching]
     
-    def __str__(self) -> str:
-        """Generate SQL CREATE TABLE statement"""
-        parts = [self._format_column(column) for column in self.column_repository.columns]
-        parts.extend([self._format_foreign_key(key) for key in self.column_repository.foreign_keys])
+    def mask(self, operator: str, expected: Any, row_ids: range) -> Optional[Any]:
+        if np is None or not row_ids:
+            return None
+        matching = self._matching_codes(operator, expected)
+        # As for numeric buffers, the views are dropped before returning
+        codes = np.frombuffer(self._codes, dtype=np.uint16)[row_ids.start:row_ids.stop]
+        nulls = np.frombuffer(self._nulls, dtype=np.bool_)[row_ids.start:row_ids.stop]
+        return np.isin(codes, matching) & ~nulls
+    
+    def nbytes(self) -> int:
+        return (
+            self._codes.itemsize * len(self._codes) + len(self._nulls)
+            + sum(sys.getsizeof(value) for value in self.dictionary)
+        )
+    
+    def header(self) -> Dict[str, Any]:
+        return {"dictionary": self.dictionary}
+    
+    def map(self, parts: Dict[str, memoryview], header: Dict[str, Any]) -> None:
+        super().map(parts, header)
+        self.dictionary = header["dictionary"]
+        self._code_of = {value: code for code, value in enumerate(self.dictionary)}
+    
+class ObjectColumnBuffer(ColumnBuffer):
+    """Plain list for the types without a compact representation (DATETIME, DATE and foreign keys)"""
+    kind = "object"
+    
+    def __init__(self) -> None:
+        super().__init__()
+        self._values: List[Any] = []
         
-        return f"CREATE TABLE {self.table_name} (\n    " + ",\n    ".join(parts) + "\n)"
-
-def create_table(table_name: str) -> 'Table':
-    column_repo = ColumnRepository()
-    row_repo = RowRepository()
-    table = Table(table_name, column_repo, row_repo)
-    return table
-
-# Example tables
-# Create users table
-users = create_table("users")
-users.add_column("id", SQLDataType.INT, is_pk=True, auto_increment=True)
-users.add_column("username", SQLDataType.TEXT, not_null=True, unique=True)
-users.add_column("email", SQLDataType.TEXT, not_null=True)
-users.add_column("created_at", SQLDataType.DATETIME, default_value="CURRENT_TIMESTAMP")
-
-# Add some user rows
-users.add_row({
-    "username": "john_doe",
-    "email": "john@example.com"
-})
-users.add_row({
-    "username": "jane_smith", 
-    "email": "jane@example.com"
-})
-
-# Create orders table with foreign key to users
-orders = create_table("orders")
-orders.add_column("id", SQLDataType.INT, is_pk=True, auto_increment=True)
-orders.add_column("total", SQLDataType.DECIMAL, not_null=True)
-orders.add_column("order_date", SQLDataType.DATETIME, default_value="CURRENT_TIMESTAMP")
-orders.add_foreign_key("user_id", users, "id")
+    def _append_value(self, value: Any) -> None:
+        self._values.append(value)
+        
+    def _get_value(self, index: int) -> Any:
+        return self._values[index]
+    
+    def nbytes(self) -> int:
+        return sys.getsizeof(self._values) + len(self._nulls)
+    
+    def parts(self) -> Dict[str, Any]:
+        # The values have no fixed size, so they are pickled and read back in full
+        return {"nulls": self._nulls, "values": pickle.dumps(self._values, protocol=pickle.HIGHEST_PROTOCOL)}
+    
+    def map(self, parts: Dict[str, memoryview], header: Dict[str, Any]) -> None:
+        super().map({"nulls": parts["nulls"]}, header)
+        self._values = pickle.loads(parts["values"])
+    
+buffer_kinds: Dict[str, Type[ColumnBuffer]] = {
+    "numeric": NumericColumnBuffer,
+    "text": TextColumnBuffer,
+    "dictionary": DictionaryColumnBuffer,
+    "object": ObjectColumnBuffer
+}
 
-# Add some order rows
-orders.add_row({
-    "user_id": 1,
-    "total": "99.99"
-})
-orders.add_row({
-    "user_id": 2,
-    "total": "149.99"
-})
+def write_column_file(path: str, buffer: ColumnBuffer) -> List[Tuple[str, int, int, str]]:
+    """Write the arrays of a buffer one after the other, each aligned to 8 bytes. Returns (part, offset, bytes, format) of each"""
+    layout: List[Tuple[str, int, int, str]] = []
+    with open(path, "wb") as file:
+        for name, part in buffer.parts().items():
+            view = memoryview(part)
+            file.write(bytes(-file.tell() % 8))
+            layout.append((name, file.tell(), view.nbytes, view.format))
+            file.write(view.cast("B") if view.nbytes else b"")
+        file.flush()
+        os.fsync(file.fileno())
+    return layout
 
-# Create products table
-products = create_table("products")
-products.add_column("id", SQLDataType.INT, is_pk=True, auto_increment=True) 
-products.add_column("name", SQLDataType.TEXT, not_null=True)
-products.add_column("price", SQLDataType.DECIMAL, not_null=True)
-products.add_column("stock", SQLDataType.INT, default_value="0")
+def open_column_file(path: str, metadata: Dict[str, Any]) -> ColumnBuffer:
+    """Map a column file back into a buffer of the kind it was written from"""
+    kind = metadata["kind"]
+    buffer = NumericColumnBuffer(SQLDataType(metadata["data_type"])) if kind == "numeric" else buffer_kinds[kind]()
+    with open(path, "rb") as file:
+        # The mapping stays valid after the file is closed, pages are only read when accessed
+        is_empty = os.fstat(file.fileno()).st_size == 0
+        mapped = memoryview(b"") if is_empty else memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+    parts = {name: mapped[offset:offset + size].cast(format) for name, offset, size, format in metadata["parts"]}
+    buffer.map(parts, metadata)
+    return buffer
+    
+def create_column_buffer(data_type: Optional[SQLDataType]) -> ColumnBuffer:
+    if data_type in buffer_typecodes:
+        return NumericColumnBuffer(data_type)
+    if data_type == SQLDataType.TEXT:
+        # Every TEXT column starts dictionary encoded, until it has too many distinct values
+        return DictionaryColumnBuffer()
+    return ObjectColumnBuffer()
 
-# Add some product rows
-products.add_row({
-    "name": "Laptop",
-    "price": "999.99",
-    "stock": 50
-})
-products.add_row({
-    "name": "Mouse",
-    "price": "24.99",
-    "stock": 100
-})
+class ColumnarRowRepository:
+    """
+    Stores rows as one buffer per column instead of one Row object per row.
+    Removed rows are only marked as deleted, so the position of a row stays its id.
+    """
+    def __init__(self) -> None:
+        self._buffers: Dict[str, ColumnBuffer] = {}
+        self._row_count = 0
+        self._deleted: Set[int] = set()
+        self._layouts = RowLayouts()
+        self._constraints = UniqueConstraints(lambda: self.rows)
+        
+    def _buffer(self, name: str, data_type: Optional[SQLDataType]) -> ColumnBuffer:
+        """Get the buffer of a column, creating it (with NULLs for the existing rows) when needed"""
+        buffer = self._buffers.get(name)
+        if buffer is None:
+            buffer = create_column_buffer(data_type)
+            for _ in range(self._row_count):
+                buffer.append(None)
+            self._buffers[name] = buffer
+        return buffer
+        
+    def dictionary(self, name: str) -> Optional[List[str]]:
+        """Distinct values of a dictionary encoded column (indexed by code), None for the other columns"""
+        buffer = self._buffers.get(name)
+        return buffer.dictionary if isinstance(buffer, DictionaryColumnBuffer) else None
+    
+    def code_readers(self, names: Set[str]) -> Dict[str, Callable[[Iterable[int]], Iterator[Optional[int]]]]:
+        """Code readers of the named columns that are still dictionary encoded, taken once when a scan opens"""
+        buffers = ((name, self._buffers.get(name)) for name in names)
+        return {name: buffer.code_reader() for name, buffer in buffers if isinstance(buffer, DictionaryColumnBuffer)}
+        
+    def _converted(self, values: Dict[str, Any], columns: List[Column], foreign_keys: List[ForeignKey]) -> Dict[str, Any]:
+        """
+        The values of a row converted to the types of their buffers, checked before anything is stored.
+        Raises a ValueError for an integer that doesn't fit in 64 bits
+        """
+        converted = {column.name: convert_value(values.get(column.name), column.data_type) for column in columns}
+        for key in foreign_keys:
+            converted[key.name] = convert_value(values.get(key.name), key.data_type)
+        for column in [*columns, *foreign_keys]:
+            message = out_of_range(column, converted[column.name])
+            if message:
+                raise ValueError(message)
+        return converted
+        
+    def add_row(self, values: Dict[str, Any], columns: List[Column], foreign_keys: List[ForeignKey]) -> Optional[Row]:
+        try:
+            Row(columns, foreign_keys, values)
+            converted = self._converted(values, columns, foreign_keys)
+            self._constraints.check(converted, columns)
+        except:
+            print(f"Failed to create a row with values: {values}")
+            return None
+        
+        self._constraints.add(converted, columns)
+        for column in columns:
+            self._buffer(column.name, column.data_type).append(converted[column.name])
+        for key in foreign_keys:
+            self._buffer(key.name, key.data_type).append(converted[key.name])
+        self._row_count += 1
+        
+        # Buffers of columns removed from the schema stay aligned with the others
+        for buffer in self._buffers.values():
+            if len(buffer) < self._row_count:
+                buffer.append(None)
+                
+        return Row._from_storage(tuple(converted.values()), self._row_count - 1, self._layouts[tuple(converted)])
+    
+    def add_rows(
+        self,
+        batch: List[Dict[str, Any]],
+        columns: List[Column],
+        foreign_keys: List[ForeignKey]
+    ) -> Tuple[List[Row], Dict[int, str]]:
+        """Validate a batch of rows and append the valid ones to every buffer in one go"""
+        errors = BatchValidator(columns, foreign_keys).validate(batch)
+        constrained = self._constraints.constrained_columns(columns)
+        
+        # Every value is converted and range checked before anything is stored
+        candidates = [position for position in range(len(batch)) if position not in errors]
+        candidate_rows = [batch[position] for position in candidates]
+        converted_columns: List[List[Any]] = []
+        for column in [*columns, *foreign_keys]:
+            converter = converters.get(column.data_type)
+            raw_values = [values.get(column.name) for values in candidate_rows]
+            converted = [None if value is None else converter(value) for value in raw_values] if converter else raw_values
+            present = [value for value in converted if value is not None] if column.data_type in (SQLDataType.INT, SQLDataType.BIGINT) else []
+            if present and (min(present) < BIGINT_MIN or max(present) > BIGINT_MAX):
+                for position, value in zip(candidates, converted):
+                    message = out_of_range(column, value)
+                    if message:
+                        errors.setdefault(position, message)
+            converted_columns.append(converted)
+            
+        accepted: List[int] = [] # Indexes in candidates of the rows that are stored
+        for index, (position, values) in enumerate(zip(candidates, candidate_rows)):
+            if position in errors:
+                continue
+            duplicate = self._constraints.find_duplicate(values, constrained)
+            if duplicate:
+                errors[position] = duplicate
+                continue
+            self._constraints.add_constrained(values, constrained)
+            accepted.append(index)
+            
+        names: List[str] = []
+        column_values: List[List[Any]] = []
+        for column, converted in zip([*columns, *foreign_keys], converted_columns):
+            if len(accepted) < len(candidates):
+                converted = [converted[index] for index in accepted]
+            self._buffer(column.name, column.data_type).extend(converted)
+            names.append(column.name)
+            column_values.append(converted)
+            
+        first_row_id = self._row_count
+        self._row_count += len(accepted)
+        for buffer in self._buffers.values():
+            if len(buffer) < self._row_count:
+                buffer.extend([None] * (self._row_count - len(buffer)))
+                
+        layout = self._layouts[tuple(names)]
+        stored = [
+            Row._from_storage(values, first_row_id + offset, layout)
+            for offset, values in enumerate(zip(*column_values))
+        ]
+        return stored, errors
+    
+    def remove_row(self, row: Row) -> bool:
+        if row.row_id is not None and row.row_id < self._row_count and row.row_id not in self._deleted:
+            self._deleted.add(row.row_id)
+            self._constraints.discard(row.values)
+            return True
+        
+        print("Row doesn't exist")
+        return False
+    
+    @property
+    def rows(self) -> Iterator[Row]:
+        layout = self._layouts[tuple(self._buffers)]
+        for row_id, values in enumerate(zip(*self._buffers.values())):
+            if row_id not in self._deleted:
+                yield Row._from_storage(values, row_id, layout)
+    
+    def __len__(self) -> int:
+        return self._row_count - len(self._deleted)
+    
+    @property
+    def next_row_id(self) -> int:
+        """Id the next stored row gets, every stored row has a smaller one"""
+        return self._row_count
+    
+    def matching_row_ids(self, conditions: List[Tuple[str, str, Any]], row_ids: Optional[Union[range, List[int]]] = None) -> List[int]:
+        """
+        Ids of the rows (all of them or the given ones) matching every condition, evaluated one column at a time.
+        Numeric conditions on a range of rows are answered with NumPy masks over whole buffers when available,
+        the others only test the rows still matching
+        """
+        scanned = range(self._row_count) if row_ids is None else row_ids
+        remaining: List[Tuple[ColumnBuffer, str, Any]] = []
+        matches = None
+        for field, operator, expected in conditions:
+            buffer = self._buffers.get(field)
+            if buffer is None:
+                return [] # A column without a buffer only holds NULLs
+            mask = buffer.mask(operator, expected, scanned) if isinstance(scanned, range) else None
+            if mask is None:
+                remaining.append((buffer, operator, expected))
+            else:
+                matches = mask if matches is None else matches & mask
+                
+        candidates: Iterable[int] = scanned if matches is None else (np.flatnonzero(matches) + scanned.start).tolist()
+        for buffer, operator, expected in remaining:
+            candidates = buffer.select(operator, expected, candidates)
+        return [row_id for row_id in candidates if row_id not in self._deleted]
+    
+    def _column(
+        self,
+        name: str,
+        row_ids: Iterable[int],
+        encoded: Dict[str, Callable[[Iterable[int]], Iterator[Optional[int]]]]
+    ) -> Iterable[Any]:
+        buffer = self._buffers.get(name)
+        if buffer is None:
+            return repeat(None)
+        if name in encoded:
+            return encoded[name](row_ids)
+        return buffer.values(row_ids)
+    
+    def records(
+        self,
+        columns: List[Column],
+        foreign_keys: List[ForeignKey],
+        conditions: Optional[List[Tuple[str, str, Any]]] = None,
+        row_ids: Optional[Union[range, List[int]]] = None,
+        encoded: Optional[Dict[str, Callable[[Iterable[int]], Iterator[Optional[int]]]]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the stored rows matching the conditions as records, reading every column from its buffer.
+        row_ids limits the scan to a partition or a sample of the rows and the columns with a reader
+        in encoded (see code_readers) hold their codes instead of their values
+        """
+        names = [column.name for column in columns] + [key.name for key in foreign_keys]
+        if conditions:
+            scanned: Iterable[int] = self.matching_row_ids(conditions, row_ids)
+            deleted: Set[int] = set() # Already left out of the matching rows
+        else:
+            scanned = range(self._row_count) if row_ids is None else row_ids
+            deleted = self._deleted
+            
+        buffers = [self._column(name, scanned, encoded or {}) for name in names]
+        for row_id, values in zip(scanned, zip(*buffers)):
+            if row_id not in deleted:
+                yield dict(zip(names, values))
+                
+    def column_values(
+        self,
+        name: str,
+        data_type: Optional[SQLDataType] = None,
+        row_ids: Optional[Iterable[int]] = None
+    ) -> Iterator[Tuple[int, Any]]:
+        """(row id, value) of one column for every stored row, or for those of row_ids"""
+        buffer = self._buffers.get(name)
+        scanned = range(self._row_count) if row_ids is None else row_ids
+        values = buffer.values(scanned) if buffer is not None else repeat(None)
+        for row_id, value in zip(scanned, values):
+            if row_id not in self._deleted:
+                yield row_id, value
+                
+    def record(self, row_id: int, columns: List[Column], foreign_keys: List[ForeignKey]) -> Dict[str, Any]:
+        """Get a single stored row as a record"""
+        record = {}
+        for name in [column.name for column in columns] + [key.name for key in foreign_keys]:
+            buffer = self._buffers.get(name)
+            record[name] = buffer.get(row_id) if buffer is not None else None
+        return record
+    
+    def row(self, row_id: int) -> Optional[Row]:
+        """The stored row with this id, None if it was removed"""
+        if row_id >= self._row_count or row_id in self._deleted:
+            return None
+        values = tuple(buffer.get(row_id) for buffer in self._buffers.values())
+        return Row._from_storage(values, row_id, self._layouts[tuple(self._buffers)])
+                
+    def memory_usage(self) -> int:
+        """Number of bytes held by the column buffers"""
+        return sum(buffer.nbytes() for buffer in self._buffers.values())
+    
+    def save(self, directory: str, generation: int) -> Dict[str, Any]:
+        """Write every buffer to its own column file in directory. Returns the metadata open needs to map them back"""
+        buffers: Dict[str, Dict[str, Any]] = {}
+        for position, (name, buffer) in enumerate(self._buffers.items()):
+            # A new name per save, since the files of the previous one may still be mapped
+            file_name = f"column_{position}.{generation}.bin"
+            layout = write_column_file(os.path.join(directory, file_name), buffer)
+            buffers[name] = {"kind": buffer.kind, "file": file_name, "parts": layout, **buffer.header()}
+        return {"row_count": self._row_count, "deleted": sorted(self._deleted), "buffers": buffers}
+    
+    @classmethod
+    def open(cls, directory: str, metadata: Dict[str, Any]) -> 'ColumnarRowRepository':
+        """Map the column files written by save, without reading them"""
+        repository = cls()
+        repository._row_count = metadata["row_count"]
+        repository._deleted = set(metadata["deleted"])
+        for name, buffer_metadata in metadata["buffers"].items():
+            repository._buffers[name] = open_column_file(os.path.join(directory, buffer_metadata["file"]), buffer_metadata)
+        return repository
+    
+    @classmethod
+    def from_row_store(
+        cls,
+        repository: RowRepository,
+        columns: List[Column],
+        foreign_keys: List[ForeignKey]
+    ) -> 'ColumnarRowRepository':
+        """The rows of a row store with the same ids (removed rows are marked as deleted), used to save it"""
+        copy = cls()
+        row_count = repository.next_row_id
+        names = [(column.name, column.data_type) for column in [*columns, *foreign_keys]]
+        for name, data_type in names:
+            values: List[Any] = [None] * row_count
+            for row_id, value in repository.column_values(name, data_type):
+                values[row_id] = value
+            copy._buffer(name, data_type).extend(values)
+        copy._row_count = row_count
+        copy._deleted = set(range(row_count)).difference(row.row_id for row in repository.rows)
+        return copy
+
+class Index(ABC):
+    """Secondary index mapping the values of one column to the ids of the rows that hold them"""
+    kind: str
+    operators: Tuple[str, ...]
+    
+    def __init__(self, column_name: str, data_type: Optional[SQLDataType]) -> None:
+        self.column_name = column_name
+        self.data_type = data_type
+        
+    def _key(self, row: Row) -> Any:
+        return convert_value(row.get(self.column_name), self.data_type)
+    
+    def insert_row(self, row: Row) -> None:
+        self._insert(self._key(row), row.row_id)
+        
+    def insert_rows(self, rows: Iterable[Row]) -> None:
+        for row in rows:
+            self.insert_row(row)
+        
+    def delete_row(self, row: Row) -> None:
+        self._delete(self._key(row), row.row_id)
+        
+    @abstractmethod
+    def _insert(self, key: Any, row_id: int) -> None:
+        pass
+    
+    @abstractmethod
+    def _delete(self, key: Any, row_id: int) -> None:
+        pass
+    
+    @abstractmethod
+    def lookup(self, operator: str, value: Any) -> Iterator[int]:
+        """Ids of the rows where the column matches the condition"""
+        pass
+    
+class HashIndex(Index):
+    kind = "hash"
+    operators = ("=", "IN")
+    
+    def __init__(self, column_name: str, data_type: Optional[SQLDataType]) -> None:
+        super().__init__(column_name, data_type)
+        # Dicts keep the row ids of a key in insertion order and delete them in O(1)
+        self._entries: Dict[Any, Dict[int, None]] = {}
+        
+    def _insert(self, key: Any, row_id: int) -> None:
+        if key is not None:
+            self._entries.setdefault(key, {})[row_id] = None
+            
+    def _delete(self, key: Any, row_id: int) -> None:
+        row_ids = self._entries.get(key)
+        if row_ids is not None:
+            row_ids.pop(row_id, None)
+            if not row_ids:
+                del self._entries[key]
+                
+    def lookup(self, operator: str, value: Any) -> Iterator[int]:
+        if operator == "IN":
+            yield from sorted(chain.from_iterable(self._entries.get(key, ()) for key in set(value)))
+        else:
+            yield from self._entries.get(value, ())
+            
+class SortedIndex(Index):
+    kind = "sorted"
+    operators = ("=", ">", "<", ">=", "<=", "IN")
+    
+    def __init__(self, column_name: str, data_type: Optional[SQLDataType]) -> None:
+        super().__init__(column_name, data_type)
+        # (key, row id) pairs kept sorted, so equal keys stay in insertion order
+        self._entries: List[Tuple[Any, int]] = []
+        self._nulls: Dict[int, None] = {}
+        
+    def _insert(self, key: Any, row_id: int) -> None:
+        if key is None:
+            self._nulls[row_id] = None
+        else:
+            insort(self._entries, (key, row_id))
+            
+    def insert_rows(self, rows: Iterable[Row]) -> None:
+        """Append a batch and sort once, instead of an O(n) insort per row"""
+        entries: List[Tuple[Any, int]] = []
+        for row in rows:
+            key = self._key(row)
+            if key is None:
+                self._nulls[row.row_id] = None
+            else:
+                entries.append((key, row.row_id))
+        entries.sort()
+        # The stored entries and the batch are two sorted runs, which the sort merges in linear time.
+        # The merged list replaces the old one, so a lookup never sees it half sorted
+        merged = self._entries + entries
+        merged.sort()
+        self._entries = merged
+            
+    def _delete(self, key: Any, row_id: int) -> None:
+        if key is None:
+            self._nulls.pop(row_id, None)
+            return
+        
+        position = bisect_left(self._entries, (key, row_id))
+        if position < len(self._entries) and self._entries[position] == (key, row_id):
+            del self._entries[position]
+            
+    def _range(
+        self,
+        low: Any = None,
+        high: Any = None,
+        low_inclusive: bool = True,
+        high_inclusive: bool = True
+    ) -> Iterator[int]:
+        key = itemgetter(0)
+        start = 0
+        stop = len(self._entries)
+        if low is not None:
+            start = (bisect_left if low_inclusive else bisect_right)(self._entries, low, key=key)
+        if high is not None:
+            stop = (bisect_right if high_inclusive else bisect_left)(self._entries, high, key=key)
+            
+        for position in range(start, stop):
+            yield self._entries[position][1]
+            
+    def lookup(self, operator: str, value: Any) -> Iterator[int]:
+        if operator == "IN":
+            for key in sorted(set(value)):
+                yield from self._range(key, key)
+        elif operator == "=":
+            yield from self._range(value, value)
+        elif operator == ">":
+            yield from self._range(low=value, low_inclusive=False)
+        elif operator == ">=":
+            yield from self._range(low=value)
+        elif operator == "<":
+            yield from self._range(high=value, high_inclusive=False)
+        elif operator == "<=":
+            yield from self._range(high=value)
+            
+    def ordered(self, is_desc: bool = False) -> Iterator[int]:
+        """Ids of all rows in ORDER BY order: NULLs first, equal keys in insertion order"""
+        if not is_desc:
+            yield from self._nulls
+            for _, row_id in self._entries:
+                yield row_id
+            return
+        
+        for _, group in groupby(reversed(self._entries), key=itemgetter(0)):
+            yield from reversed([row_id for _, row_id in group])
+        yield from self._nulls
+        
+index_kinds: Dict[str, Type[Index]] = {
+    HashIndex.kind: HashIndex,
+    SortedIndex.kind: SortedIndex
+}
+
+ZONE_MAP_BLOCK_SIZE = 4096 # Consecutive row ids summarised by one entry of a zone map
+zone_map_types = (SQLDataType.INT, SQLDataType.BIGINT, SQLDataType.FLOAT, SQLDataType.DECIMAL, SQLDataType.DATETIME)
+
+class ZoneMap:
+    """
+    Min, max and NULL count of one column for every block of ZONE_MAP_BLOCK_SIZE row ids,
+    so scans skip the blocks that can't hold a row matching a range or equality condition.
+    Removing a row doesn't shrink min and max: they stay a valid (if looser) bound
+    """
+    def __init__(self, column_name: str, data_type: SQLDataType) -> None:
+        self.column_name = column_name
+        self.data_type = data_type
+        self._mins: List[Any] = []
+        self._maxs: List[Any] = []
+        self._null_counts: List[int] = []
+        self._row_counts: List[int] = []
+        self._unordered: Set[int] = set() # Blocks holding values that can't be compared with each other
+        
+    def _block(self, row_id: int) -> int:
+        block = row_id // ZONE_MAP_BLOCK_SIZE
+        while len(self._row_counts) <= block:
+            self._mins.append(None)
+            self._maxs.append(None)
+            self._null_counts.append(0)
+            self._row_counts.append(0)
+        return block
+    
+    def insert_row(self, row: Row) -> None:
+        self.insert(row.row_id, convert_value(row.get(self.column_name), self.data_type))
+        
+    def insert(self, row_id: int, value: Any) -> None:
+        block = self._block(row_id)
+        self._row_counts[block] += 1
+        if value is None:
+            self._null_counts[block] += 1
+            return
+        
+        try:
+            if self._mins[block] is None or value < self._mins[block]:
+                self._mins[block] = value
+            if self._maxs[block] is None or value > self._maxs[block]:
+                self._maxs[block] = value
+        except TypeError:
+            self._unordered.add(block)
+            
+    def delete_row(self, row: Row) -> None:
+        block = self._block(row.row_id)
+        self._row_counts[block] -= 1
+        if row.get(self.column_name) is None:
+            self._null_counts[block] -= 1
+            
+    def may_match(self, block: int, operator: str, value: Any) -> bool:
+        """False only when no row of the block can match the condition (NULLs never match)"""
+        if block >= len(self._row_counts):
+            return False
+        if self._null_counts[block] == self._row_counts[block]:
+            return False
+        
+        low, high = self._mins[block], self._maxs[block]
+        if block in self._unordered or operator == "LIKE":
+            return True
+        try:
+            if operator == "=":
+                return low <= value <= high
+            if operator == "IN":
+                return any(low <= item <= high for item in value)
+            if operator == ">":
+                return high > value
+            if operator == ">=":
+                return high >= value
+            if operator == "<":
+                return low < value
+            if operator == "<=":
+                return low <= value
+        except TypeError:
+            pass
+        return True
+    
+HISTOGRAM_BUCKETS = 32
+STATISTICS_SAMPLE_SIZE = 30000 # Rows read to compute the statistics of a column
+STATISTICS_REFRESH_RATIO = 0.1 # Statistics are recomputed once this fraction of the rows changed
+DEFAULT_SELECTIVITY = 0.1 # Fraction of rows a condition is assumed to keep when nothing better is known
+
+@dataclass
+class ColumnStatistics:
+    """Summary of the values of one column, used to estimate how many rows a condition keeps"""
+    row_count: int
+    null_count: int
+    distinct_count: int
+    histogram: List[Any] = field(default_factory=list) # Equi-depth bucket bounds, empty when the values can't be ordered
+    
+    @classmethod
+    def from_sample(cls, values: List[Any], row_count: int) -> 'ColumnStatistics':
+        """
+        Statistics of a column from the values of a random sample of its rows. The number of
+        distinct values is scaled to the whole table with the Haas-Stokes (Duj1) estimator
+        """
+        sample_size = len(values)
+        not_null = [value for value in values if value is not None]
+        counts: Dict[Any, int] = {}
+        for value in not_null:
+            counts[value] = counts.get(value, 0) + 1
+            
+        distinct_count = len(counts)
+        if sample_size < row_count and not_null:
+            seen_once = sum(1 for count in counts.values() if count == 1)
+            estimate = sample_size * distinct_count / (sample_size - seen_once + seen_once * sample_size / row_count)
+            distinct_count = round(min(max(estimate, distinct_count), row_count))
+            
+        histogram: List[Any] = []
+        try:
+            ordered = sorted(not_null)
+            histogram = [ordered[min(len(ordered) - 1, bucket * len(ordered) // HISTOGRAM_BUCKETS)] for bucket in range(HISTOGRAM_BUCKETS + 1)] if ordered else []
+        except TypeError:
+            pass
+        
+        null_count = round((sample_size - len(not_null)) * row_count / sample_size) if sample_size else 0
+        return cls(row_count, null_count, distinct_count, histogram)
+    
+    def selectivity(self, operator: str, value: Any) -> float:
+        """Estimated fraction of the rows matching a WHERE condition (NULLs never match)"""
+        if self.row_count == 0:
+            return 0.0
+        
+        not_null = 1 - self.null_count / self.row_count
+        if operator == "=":
+            return not_null / max(self.distinct_count, 1)
+        if operator == "IN":
+            return not_null * min(1.0, len(value) / max(self.distinct_count, 1))
+        if operator in (">", ">=", "<", "<=") and self.histogram:
+            try:
+                below = self._fraction_below(value)
+            except TypeError:
+                return not_null * DEFAULT_SELECTIVITY
+            return not_null * (below if operator in ("<", "<=") else 1 - below)
+        return not_null * DEFAULT_SELECTIVITY
+    
+    def _fraction_below(self, value: Any) -> float:
+        """Fraction of the non NULL values below value, interpolating inside its histogram bucket"""
+        histogram = self.histogram
+        if value <= histogram[0]:
+            return 0.0
+        if value >= histogram[-1]:
+            return 1.0
+        
+        bucket = bisect_right(histogram, value) - 1
+        low, high = histogram[bucket], histogram[bucket + 1]
+        try:
+            within = (value - low) / (high - low) if high != low else 0.5
+        except TypeError: # Values without a distance, like text
+            within = 0.5
+        return (bucket + within) / (len(histogram) - 1)
+    
+class IdBlock:
+    """A contiguous range of ids reserved by one loader, handed out without touching the shared sequence"""
+    def __init__(self, start: int, stop: int) -> None:
+        self.start = start
+        self.stop = stop
+        self._next = start
+        
+    def next_value(self) -> int:
+        if self._next >= self.stop:
+            raise ValueError(f"All ids between {self.start} and {self.stop - 1} were already used")
+        value = self._next
+        self._next += 1
+        return value
+    
+    def __len__(self) -> int:
+        return self.stop - self._next
+    
+    def __iter__(self) -> Iterator[int]:
+        while self._next < self.stop:
+            yield self.next_value()
+
+class SequenceAllocator:
+    """Hands out increasing ids for an AUTO_INCREMENT column. Safe to share between threads"""
+    def __init__(self, start: int = 1) -> None:
+        self._next = start
+        self._lock = threading.Lock()
+        
+    def next_value(self) -> int:
+        with self._lock:
+            value = self._next
+            self._next += 1
+            return value
+        
+    def reserve(self, count: int) -> IdBlock:
+        """Reserve count contiguous ids with a single update of the sequence"""
+        if count < 1:
+            raise ValueError("Can only reserve a positive number of ids")
+        with self._lock:
+            block = IdBlock(self._next, self._next + count)
+            self._next += count
+            return block
+        
+    def advance_past(self, value: int) -> None:
+        """Make sure an explicitly inserted id is never handed out again"""
+        # Ids from reserved blocks are always behind the sequence, so they skip the lock
+        if value >= self._next:
+            with self._lock:
+                self._next = max(self._next, value + 1)
+
+@dataclass
+class RowError:
+    """A row that a bulk load skipped, with its position in the input"""
+    position: int
+    values: Dict[str, Any]
+    message: str
+    
+@dataclass
+class BulkLoadResult:
+    """Outcome of Table.add_rows"""
+    inserted: int = 0
+    errors: List[RowError] = field(default_factory=list)
+
+TABLE_METADATA_FILE = "table.json" # Schema and column file layout of a saved table
+TABLE_FORMAT_VERSION = 1
+WAL_FILE = "wal.log"
+WAL_CHECKPOINT_SIZE = 64 * 1024 * 1024 # Bytes of log after which a table is checkpointed into its column files
+wal_record_header = struct.Struct("<II") # Length and CRC32 of the pickled record that follows
+
+class WriteAheadLog:
+    """
+    Append-only log of the rows added to and removed from a saved table since its last checkpoint.
+    A writer appends its record and then waits in sync: the first waiting writer flushes and fsyncs
+    the records of all the others too, so concurrent writers share one fsync (group commit)
+    """
+    def __init__(self, path: str, last_sequence: int = 0) -> None:
+        self.path = path
+        self.last_sequence = last_sequence # Sequence number of the last appended record
+        self.syncs = 0
+        self._file = open(path, "ab")
+        self._synced = last_sequence
+        self._is_syncing = False
+        self._condition = threading.Condition()
+        
+    @staticmethod
+    def read(path: str) -> Iterator[Tuple[int, str, Any]]:
+        """(sequence, kind, payload) of every record in order, cutting off a last record that wasn't completely written"""
+        if not os.path.exists(path):
+            return
+        with open(path, "r+b") as file:
+            while True:
+                offset = file.tell()
+                header = file.read(wal_record_header.size)
+                if len(header) == wal_record_header.size:
+                    size, checksum = wal_record_header.unpack(header)
+                    data = file.read(size)
+                    if len(data) == size and zlib.crc32(data) == checksum:
+                        yield pickle.loads(data)
+                        continue
+                file.truncate(offset)
+                return
+            
+    def append(self, kind: str, payload: Any) -> int:
+        """Write a record, which is only durable once sync returns. Returns its sequence number"""
+        with self._condition:
+            self.last_sequence += 1
+            data = pickle.dumps((self.last_sequence, kind, payload), protocol=pickle.HIGHEST_PROTOCOL)
+            self._file.write(wal_record_header.pack(len(data), zlib.crc32(data)))
+            self._file.write(data)
+            return self.last_sequence
+        
+    def sync(self, sequence: int) -> None:
+        """Wait until the record with this sequence number (and every earlier one) is on disk"""
+        with self._condition:
+            while self._synced < sequence:
+                if self._is_syncing:
+                    self._condition.wait()
+                    continue
+                
+                self._is_syncing = True
+                target = self.last_sequence
+                self._file.flush()
+                # Writers keep appending while the disk syncs, their records go in the next fsync
+                self._condition.release()
+                try:
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._condition.acquire()
+                    self._is_syncing = False
+                    self._condition.notify_all()
+                self._synced = max(self._synced, target)
+                self.syncs += 1
+                
+    @property
+    def size(self) -> int:
+        with self._condition:
+            return self._file.tell()
+                
+    def truncate(self) -> None:
+        """Drop every record, once a checkpoint wrote them to the column files"""
+        with self._condition:
+            self._file.flush()
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+            self._synced = self.last_sequence
+            
+    def close(self) -> None:
+        self.sync(self.last_sequence)
+        self._file.close()
+
+class Table:
+    def __init__(
+        self,
+        table_name: str,
+        column_repository: ColumnRepository,
+        row_repository: Union[RowRepository, ColumnarRowRepository]
+    ) -> None:
+        self.table_name: str = table_name
+        self.column_repository = column_repository
+        self.row_repository = row_repository
+        self.indexes: List[Index] = []
+        self.zone_maps: Dict[str, ZoneMap] = {}
+        self._sequences: Dict[str, SequenceAllocator] = {}
+        self._statistics: Dict[str, Tuple[ColumnStatistics, int]] = {} # Column -> (statistics, modifications when computed)
+        self.statistics_version = 0 # Increased every time statistics are computed or dropped
+        self.materialized_views: List['MaterializedView'] = []
+        self._modifications = 0 # Rows added or removed so far
+        self.path: Optional[str] = None # Directory the table was saved to or opened from
+        self._log: Optional[WriteAheadLog] = None # Rows added and removed since the last save of path
+        self._write_lock = threading.RLock()
+        
+    def add_column(
+        self,
+        name: str,
+        data_type: Union[SQLDataType, str],
+        default_value: Optional[Any] = None,
+        is_pk: bool = False,
+        auto_increment: bool = False,
+        not_null: bool = False,
+        unique: bool = False    
+    ) -> 'Table':
+        try:
+            self.column_repository.add_column(
+                name=name,
+                data_type=data_type,
+                default_value=default_value,
+                is_pk=is_pk,
+                auto_increment=auto_increment,
+                not_null=not_null,
+                unique=unique
+            )
+        except Exception as error:
+            print(f"Something went wrong: {error}")
+            
+        self._checkpoint_schema()
+        return self
+    
+    def remove_column(self, column_name: str) -> 'Table':
+        if self.column_repository.column(column_name) is None:
+            valid_columns = [col.name for col in self.column_repository.columns]
+            print(f"Invalid column name. Must be one of: {', '.join(valid_columns)}")
+            return self
+        
+        self.column_repository.remove_column(column_name)
+        self._drop_indexes(column_name)
+        self._sequences.pop(column_name, None)
+        self.zone_maps.pop(column_name, None)
+        self._drop_statistics(column_name)
+        self._checkpoint_schema()
+        return self
+    
+    def add_foreign_key(
+        self,
+        name: str,
+        reference_table: 'Table',
+        reference_column_name: str
+    ) -> 'Table':
+        found_reference = reference_table.column_repository.column(reference_column_name)
+        
+        if found_reference:
+            try:
+                self.column_repository.add_foreign_key(name, reference_table.table_name, reference_column_name, found_reference.data_type)
+            except Exception as error:
+                print(f"Something went wrong: {error}")
+        else:
+            print(f"{reference_column_name} doesn't exist in the {reference_table.table_name} table")
+        
+        self._checkpoint_schema()
+        return self
+    
+    def remove_foreign_key(self, key_name: str) -> 'Table':
+        try:
+            if self.column_repository.remove_foreign_key(key_name):
+                self._drop_indexes(key_name)
+                self._drop_statistics(key_name)
+        except Exception as error:
+            print(f"Something went wrong: {error}")
+        
+        self._checkpoint_schema()
+        return self
+    
+    def add_row(self, values: Dict[str, Any]) -> 'Table':
+        auto_increment_columns = [column for column in self.column_repository.columns if column.auto_increment]
+        
+        # Assign ids to the AUTO_INCREMENT columns left empty, without changing the caller's dict
+        missing_ids = [column for column in auto_increment_columns if values.get(column.name) is None]
+        if missing_ids:
+            values = {**values, **{column.name: self.sequence(column.name).next_value() for column in missing_ids}}
+        
+        with self._write_lock:
+            row = self.row_repository.add_row(values, self.column_repository.columns, self.column_repository.foreign_keys)
+            
+            if row is not None:
+                for column in auto_increment_columns:
+                    self.sequence(column.name).advance_past(int(row.get(column.name)))
+                for index in self.indexes:
+                    index.insert_row(row)
+                for zone_map in self.zone_maps.values():
+                    zone_map.insert_row(row)
+                for view in self.materialized_views:
+                    view.insert_row(row)
+                self._modifications += 1
+                # The values as given, so that replaying them passes the same validation again
+                sequence = self._log_mutation("add", lambda: [values])
+                
+        if row is not None:
+            self._sync_log(sequence)
+        return self
+    
+    def add_rows(self, rows: Iterable[Dict[str, Any]], batch_size: int = 10000) -> BulkLoadResult:
+        """
+        Insert many rows, validating them a batch and a column at a time.
+        Invalid rows are reported in the result instead of stopping the load
+        Example: orders.add_rows(({"user_id": 1, "total": total} for total in totals), batch_size=50000)
+        """
+        result = BulkLoadResult()
+        columns = self.column_repository.columns
+        foreign_keys = self.column_repository.foreign_keys
+        auto_increment_columns = [column for column in columns if column.auto_increment]
+        rows_iterator = iter(rows)
+        position = 0
+        
+        while batch := list(islice(rows_iterator, batch_size)):
+            # One reserved block of ids per batch and AUTO_INCREMENT column
+            for column in auto_increment_columns:
+                missing_ids = [index for index, values in enumerate(batch) if values.get(column.name) is None]
+                if missing_ids:
+                    block = self.sequence(column.name).reserve(len(missing_ids))
+                    for index, new_id in zip(missing_ids, block):
+                        batch[index] = {**batch[index], column.name: new_id}
+                        
+            with self._write_lock:
+                stored, errors = self.row_repository.add_rows(batch, columns, foreign_keys)
+                
+                if stored:
+                    for column in auto_increment_columns:
+                        self.sequence(column.name).advance_past(max(int(row.get(column.name)) for row in stored))
+                    for index in self.indexes:
+                        index.insert_rows(stored)
+                    for summary in chain(self.zone_maps.values(), self.materialized_views):
+                        for row in stored:
+                            summary.insert_row(row)
+                    self._modifications += len(stored)
+                    # One log record and one fsync for the whole batch
+                    sequence = self._log_mutation("add", lambda: [values for position, values in enumerate(batch) if position not in errors])
+                    
+            if stored:
+                self._sync_log(sequence)
+            result.inserted += len(stored)
+            result.errors.extend(RowError(position + index, batch[index], message) for index, message in sorted(errors.items()))
+            position += len(batch)
+            
+        return result
+    
+    def remove_row(self, row: Row) -> 'Table':
+        with self._write_lock:
+            is_removed = self.row_repository.remove_row(row)
+            if is_removed:
+                for index in chain(self.indexes, self.zone_maps.values(), self.materialized_views):
+                    index.delete_row(row)
+                self._modifications += 1
+                sequence = self._log_mutation("remove", lambda: [row.row_id])
+                
+        if is_removed:
+            self._sync_log(sequence)
+        return self
+    
+    def _log_mutation(self, kind: Literal["add", "remove"], payload: Callable[[], List[Any]]) -> int:
+        """
+        Append a mutation already applied in memory to the log of a saved table, checkpointing a log grown too large.
+        The payload is only built when there is a log
+        """
+        if self._log is None:
+            return 0
+        sequence = self._log.append(kind, payload())
+        if self._log.size >= WAL_CHECKPOINT_SIZE:
+            self.checkpoint()
+        return sequence
+    
+    def _sync_log(self, sequence: int) -> None:
+        # Outside the write lock, so that other writers can join the same fsync
+        log = self._log
+        if log is not None:
+            log.sync(sequence)
+            
+    def _replay(self, kind: str, payload: List[Any]) -> None:
+        if kind == "add":
+            result = self.add_rows(payload)
+            if result.errors:
+                # Every logged row was stored once, so losing one now would silently drop committed data
+                error = result.errors[0]
+                raise ValueError(f"Logged row {error.values} of {self.table_name} was rejected during replay: {error.message}")
+        else:
+            for row_id in payload:
+                row = self.row_repository.row(row_id)
+                if row is not None:
+                    self.remove_row(row)
+    
+    def create_index(self, column_name: str, kind: Literal["hash", "sorted"] = "hash") -> 'Table':
+        """
+        Index a column or foreign key. Hash indexes answer = and IN conditions,
+        sorted indexes also answer ranges and ORDER BY ... LIMIT
+        """
+        if column_name not in self.column_repository:
+            print(f"Invalid column name. Must be one of: {', '.join(self.column_repository.names)}")
+            return self
+        if kind not in index_kinds:
+            print(f"Invalid index kind. Must be one of: {', '.join(index_kinds)}")
+            return self
+        if self.find_index(column_name, kind=kind):
+            print(f"A {kind} index on {column_name} already exists")
+            return self
+        
+        index = index_kinds[kind](column_name, self.column_repository.data_type(column_name))
+        index.insert_rows(self.row_repository.rows)
+            
+        self.indexes.append(index)
+        return self
+    
+    def create_materialized_view(self, query: 'QueryBuilder') -> 'MaterializedView':
+        """
+        Keep the result of a GROUP BY query with SUM, AVG and COUNT up to date on every insert and delete.
+        Queries on this table with the same GROUP BY and WHERE are then answered from it in O(groups)
+        Example: orders.create_materialized_view(QueryBuilder(orders).select("user_id").sum("total").group_by("user_id"))
+        """
+        if query.table is not self:
+            raise ValueError(f"The query of a materialized view of {self.table_name} must read {self.table_name}")
+        
+        view = MaterializedView(query)
+        for row in self.row_repository.rows:
+            view.insert_row(row)
+        self.materialized_views.append(view)
+        return view
+    
+    def find_index(self, column_name: str, operator: Optional[str] = None, kind: Optional[str] = None) -> Optional[Index]:
+        """Find an index on the column that can answer the operator, preferring hash indexes"""
+        candidates = [
+            index for index in self.indexes
+            if index.column_name == column_name
+            and (operator is None or operator in index.operators)
+            and (kind is None or index.kind == kind)
+        ]
+        return min(candidates, key=lambda index: index.kind != "hash", default=None)
+    
+    def sequence(self, column_name: str) -> SequenceAllocator:
+        """The id sequence of an AUTO_INCREMENT column, continuing after the largest stored id"""
+        sequence = self._sequences.get(column_name)
+        if sequence is not None:
+            return sequence
+        
+        with self._write_lock:
+            # Looked up again, another thread may have created it while this one waited for the lock
+            sequence = self._sequences.get(column_name)
+            if sequence is None:
+                column = self.column_repository.column(column_name)
+                if column is None or not column.auto_increment:
+                    raise ValueError(f"{column_name} is not an AUTO_INCREMENT column of {self.table_name}")
+                
+                stored_ids = (convert_value(row.get(column_name), column.data_type) for row in self.row_repository.rows)
+                sequence = SequenceAllocator(max((value for value in stored_ids if value is not None), default=0) + 1)
+                self._sequences[column_name] = sequence
+        return sequence
+    
+    def zone_map(self, column_name: str) -> Optional[ZoneMap]:
+        """
+        The zone map of a numeric or DATETIME column, built from the stored rows on first use
+        and then kept up to date by add_row, add_rows and remove_row
+        """
+        column = self.column_repository.column(column_name)
+        if column is None or column.data_type not in zone_map_types:
+            return None
+        
+        zone_map = self.zone_maps.get(column_name)
+        if zone_map is None or zone_map.data_type != column.data_type:
+            zone_map = ZoneMap(column_name, column.data_type)
+            for row_id, value in self.row_repository.column_values(column_name, column.data_type):
+                zone_map.insert(row_id, value)
+            self.zone_maps[column_name] = zone_map
+        return zone_map
+    
+    @property
+    def version(self) -> Tuple[int, int]:
+        """Changes when rows are added or removed or the schema changes"""
+        return self._modifications, self.column_repository.version
+    
+    def analyze(self, column_names: Optional[List[str]] = None) -> 'Table':
+        """
+        Compute the statistics (row count, distinct values, histogram) the planner uses to estimate
+        how many rows each step of a query produces, from a sample of STATISTICS_SAMPLE_SIZE rows.
+        Queries also compute them on first use and after STATISTICS_REFRESH_RATIO of the rows changed
+        """
+        names = self.column_repository.names if column_names is None else column_names
+        
+        invalid_names = [name for name in names if name not in self.column_repository]
+        if invalid_names:
+            print(f"Invalid column name. Must be one of: {', '.join(self.column_repository.names)}")
+            return self
+        
+        row_count = len(self.row_repository)
+        next_row_id = self.row_repository.next_row_id
+        sample = None
+        if next_row_id > STATISTICS_SAMPLE_SIZE:
+            sample = sorted(random.sample(range(next_row_id), STATISTICS_SAMPLE_SIZE))
+            
+        for name in names:
+            values = [value for _, value in self.row_repository.column_values(name, self.column_repository.data_type(name), sample)]
+            self._statistics[name] = (ColumnStatistics.from_sample(values, row_count), self._modifications)
+        self.statistics_version += 1
+        return self
+    
+    def _drop_statistics(self, column_name: str) -> None:
+        if self._statistics.pop(column_name, None) is not None:
+            self.statistics_version += 1
+    
+    def column_statistics(self, column_name: str) -> Optional[ColumnStatistics]:
+        """Statistics of a column or foreign key, computed again when they are missing or stale"""
+        if column_name not in self.column_repository:
+            return None
+        
+        cached = self._statistics.get(column_name)
+        if cached is None or self._modifications - cached[1] > STATISTICS_REFRESH_RATIO * cached[0].row_count:
+            self.analyze([column_name])
+        return self._statistics[column_name][0]
+    
+    def prune_blocks(self, conditions: List[Tuple[str, str, Any]], row_ids: range) -> Tuple[List[range], int]:
+        """
+        Ranges of row ids (within row_ids) whose blocks may hold rows matching every condition,
+        and the number of blocks the zone maps ruled out
+        """
+        zone_maps = [
+            (zone_map, operator, value)
+            for field, operator, value in conditions
+            if (zone_map := self.zone_map(field)) is not None
+        ]
+        if not zone_maps or not row_ids:
+            return [row_ids], 0
+        
+        ranges: List[range] = []
+        pruned = 0
+        for block in range(row_ids.start // ZONE_MAP_BLOCK_SIZE, (row_ids.stop - 1) // ZONE_MAP_BLOCK_SIZE + 1):
+            if not all(zone_map.may_match(block, operator, value) for zone_map, operator, value in zone_maps):
+                pruned += 1
+                continue
+            start = max(block * ZONE_MAP_BLOCK_SIZE, row_ids.start)
+            stop = min((block + 1) * ZONE_MAP_BLOCK_SIZE, row_ids.stop)
+            if ranges and ranges[-1].stop == start:
+                ranges[-1] = range(ranges[-1].start, stop)
+            else:
+                ranges.append(range(start, stop))
+        return ranges, pruned
+    
+    def save(self, path: str) -> 'Table':
+        """
+        Write the table to the directory path: one file per column holding its arrays as they are in memory,
+        plus TABLE_METADATA_FILE with the schema. Indexes, statistics and materialized views aren't saved.
+        From then on the rows added and removed are written to the log in path instead (see checkpoint)
+        Example: orders.save("data/orders")
+        """
+        with self._write_lock:
+            self._save(path)
+        return self
+    
+    def _save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        metadata_path = os.path.join(path, TABLE_METADATA_FILE)
+        generation = 1
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as file:
+                generation = json.load(file)["generation"] + 1
+                
+        columns = self.column_repository.columns
+        foreign_keys = self.column_repository.foreign_keys
+        is_row_store = isinstance(self.row_repository, RowRepository)
+        repository = ColumnarRowRepository.from_row_store(self.row_repository, columns, foreign_keys) if is_row_store else self.row_repository
+        metadata = {
+            "format": TABLE_FORMAT_VERSION,
+            "generation": generation,
+            "table_name": self.table_name,
+            "storage": "row" if is_row_store else "columnar",
+            "columns": [{**asdict(column), "data_type": column.data_type.value} for column in columns],
+            "foreign_keys": [{**asdict(key), "data_type": key.data_type.value if key.data_type else None} for key in foreign_keys],
+            "sequences": {name: sequence._next for name, sequence in self._sequences.items()},
+            "log_sequence": self._log.last_sequence if self._log is not None else 0, # Last logged mutation included
+            **repository.save(path, generation)
+        }
+        
+        # The new files only replace the old ones once the metadata pointing to them is in place
+        temporary_path = metadata_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(metadata, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, metadata_path)
+        
+        current_files = {buffer["file"] for buffer in metadata["buffers"].values()}
+        for file_name in os.listdir(path):
+            if file_name.startswith("column_") and file_name not in current_files:
+                os.remove(os.path.join(path, file_name))
+                
+        log_path = os.path.join(path, WAL_FILE)
+        if self.path is not None and os.path.samefile(path, self.path):
+            self._log.truncate()
+        elif self._log is None:
+            self.path = path
+            self._log = WriteAheadLog(log_path)
+            self._log.truncate()
+        elif os.path.exists(log_path):
+            # A copy of the table, its log stays in its own directory
+            os.remove(log_path)
+            
+    def checkpoint(self) -> 'Table':
+        """
+        Write the logged mutations of a saved table to new column files and empty the log, which keeps opening fast.
+        Happens on its own once the log reaches WAL_CHECKPOINT_SIZE bytes and on every schema change
+        """
+        if self.path is not None:
+            self.save(self.path)
+        return self
+    
+    def _checkpoint_schema(self) -> None:
+        # The log only holds rows, so it must never reach back to an older schema
+        if self.path is not None:
+            self.checkpoint()
+            
+    def close(self) -> None:
+        """Stop logging the mutations of a saved table, which stays in memory as an unsaved one"""
+        if self._log is not None:
+            self._log.close()
+        self._log = None
+        self.path = None
+    
+    @classmethod
+    def open(cls, path: str) -> 'Table':
+        """
+        Open a table written by save. The column files are memory-mapped, so nothing is read up front:
+        pages are loaded when a query first touches them, and a column is copied to memory when rows are added.
+        Saved row stores are loaded in full. The mutations logged after the last save are then applied again
+        Example: orders = Table.open("data/orders")
+        """
+        with open(os.path.join(path, TABLE_METADATA_FILE)) as file:
+            metadata = json.load(file)
+        if metadata.get("format") != TABLE_FORMAT_VERSION:
+            raise ValueError(f"{path} doesn't hold a table saved in format {TABLE_FORMAT_VERSION}")
+        
+        column_repository = ColumnRepository()
+        for column in metadata["columns"]:
+            column_repository.add_column(**column)
+        for key in metadata["foreign_keys"]:
+            column_repository.add_foreign_key(**key)
+            
+        row_repository: Union[RowRepository, ColumnarRowRepository] = ColumnarRowRepository.open(path, metadata)
+        if metadata["storage"] == "row":
+            row_repository = RowRepository.from_columnar(row_repository)
+            
+        table = cls(metadata["table_name"], column_repository, row_repository)
+        table._sequences = {name: SequenceAllocator(next_id) for name, next_id in metadata["sequences"].items()}
+        
+        log_path = os.path.join(path, WAL_FILE)
+        last_sequence = metadata["log_sequence"]
+        for sequence, kind, payload in WriteAheadLog.read(log_path):
+            if sequence > metadata["log_sequence"]: # Earlier ones were saved before the log was emptied
+                table._replay(kind, payload)
+                last_sequence = sequence
+        table.path = path
+        table._log = WriteAheadLog(log_path, last_sequence)
+        return table
+    
+    def reserve_ids(self, count: int, column_name: Optional[str] = None) -> IdBlock:
+        """
+        Reserve a block of ids for a bulk or parallel loader, which then passes them to add_row itself
+        Example: block = users.reserve_ids(1000) then users.add_row({"id": block.next_value(), ...})
+        """
+        if column_name is None:
+            column_name = next((column.name for column in self.column_repository.columns if column.auto_increment), None)
+            if column_name is None:
+                raise ValueError(f"{self.table_name} has no AUTO_INCREMENT column")
+        return self.sequence(column_name).reserve(count)
+    
+    def _drop_indexes(self, column_name: str) -> None:
+        self.indexes = [index for index in self.indexes if index.column_name != column_name]
+        self.materialized_views = [view for view in self.materialized_views if column_name not in view.column_names]
+    
+    def _format_column(self, column: Column) -> str:
+        """Format a column definition as SQL"""
+        parts = [
+            column.name,
+            column.data_type.value
+        ]
+        
+        if column.default_value is not None:
+            parts.append(f"DEFAULT {column.default_value}")
+        if column.is_pk:
+            parts.append("PRIMARY KEY")
+        if column.auto_increment:
+            parts.append("AUTO_INCREMENT")
+        if column.not_null:
+            parts.append("NOT NULL")
+        if column.unique:
+            parts.append("UNIQUE")
+            
+        return " ".join(parts)
+    
+    def _format_foreign_key(self, foreign_key: ForeignKey) -> str:
+        """Format a foreign key"""
+        return f"FOREIGN KEY ({foreign_key.name}) REFERENCES {foreign_key.reference_table_name}({foreign_key.reference_column_name})"
+    
+    def __str__(self) -> str:
+        """Generate SQL CREATE TABLE statement"""
+        parts = [self._format_column(column) for column in self.column_repository.columns]
+        parts.extend([self._format_foreign_key(key) for key in self.column_repository.foreign_keys])
+        
+        return f"CREATE TABLE {self.table_name} (\n    " + ",\n    ".join(parts) + "\n)"
+
+def create_table(table_name: str, storage: Literal["row", "columnar"] = "row") -> 'Table':
+    column_repo = ColumnRepository()
+    row_repo = ColumnarRowRepository() if storage == "columnar" else RowRepository()
+    table = Table(table_name, column_repo, row_repo)
+    return table
+
+# Example tables
+# Create users table
+users = create_table("users")
+users.add_column("id", SQLDataType.INT, is_pk=True, auto_increment=True)
+users.add_column("username", SQLDataType.TEXT, not_null=True, unique=True)
+users.add_column("email", SQLDataType.TEXT, not_null=True)
+users.add_column("created_at", SQLDataType.DATETIME, default_value="CURRENT_TIMESTAMP")
+
+# Add some user rows
+users.add_row({
+    "username": "john_doe",
+    "email": "john@example.com"
+})
+users.add_row({
+    "username": "jane_smith", 
+    "email": "jane@example.com"
+})
+
+# Create orders table with foreign key to users
+orders = create_table("orders")
+orders.add_column("id", SQLDataType.INT, is_pk=True, auto_increment=True)
+orders.add_column("total", SQLDataType.DECIMAL, not_null=True)
+orders.add_column("order_date", SQLDataType.DATETIME, default_value="CURRENT_TIMESTAMP")
+orders.add_foreign_key("user_id", users, "id")
+
+# Add some order rows
+orders.add_row({
+    "user_id": 1,
+    "total": "99.99"
+})
+orders.add_row({
+    "user_id": 2,
+    "total": "149.99"
+})
+
+# Create products table
+products = create_table("products")
+products.add_column("id", SQLDataType.INT, is_pk=True, auto_increment=True) 
+products.add_column("name", SQLDataType.TEXT, not_null=True)
+products.add_column("price", SQLDataType.DECIMAL, not_null=True)
+products.add_column("stock", SQLDataType.INT, default_value="0")
+
+# Add some product rows
+products.add_row({
+    "name": "Laptop",
+    "price": "999.99",
+    "stock": 50
+})
+products.add_row({
+    "name": "Mouse",
+    "price": "24.99",
+    "stock": 100
+})
+
+EQ = "eq"
+GT = "gt"
+LT = "lt"
+GTE = "gte"
+LTE = "lte"
+LIKE = "like"
+IN = "in"
+
+operators = {
+    EQ: '=',
+    GT: '>',
+    LT: '<',
+    GTE: '>=',
+    LTE: '<=',
+    LIKE: 'LIKE',
+    IN: 'IN'
+}
+
+@dataclass(slots=True)
+class ColumnSelector:
+    column: str
+    alias: Optional[str]
+    
+@dataclass(slots=True)
+class OrderBySelector:
+    column: str
+    is_desc: bool = False
+    
+@dataclass
+class JoinClause:
+    """An inner join of table on left_table.left_column = table.right_column"""
+    table: Table
+    foreign_key: ForeignKey
+    left_table: Table
+    left_column: str
+    right_column: str
+    
+@dataclass(frozen=True, repr=False)
+class Param:
+    """
+    Placeholder for a WHERE value given when a prepared query is executed
+    Example: where(total__gt=Param("min_total")) then prepare().execute(min_total=100)
+    Results: WHERE total > :min_total
+    """
+    name: str
+    data_type: Optional[SQLDataType] = field(default=None, compare=False) # Type the value is converted to, set by the planner
+    
+    def bind(self, parameters: Dict[str, Any]) -> Any:
+        value = parameters[self.name]
+        if self.data_type is None:
+            return value
+        try:
+            if isinstance(value, (list, tuple)):
+                return [convert_value(item, self.data_type) for item in value]
+            return convert_value(value, self.data_type)
+        except ValueError:
+            return value
+        
+    def __str__(self) -> str:
+        return f":{self.name}"
+    
+    __repr__ = __str__
+    
+def bind_conditions(conditions: List[Tuple[str, str, Any]], parameters: Dict[str, Any]) -> List[Tuple[str, str, Any]]:
+    return [
+        (field, operator, value.bind(parameters) if isinstance(value, Param) else value)
+        for field, operator, value in conditions
+    ]
+
+CURSOR_BATCH_SIZE = 1000 # Records fetchmany and as_columns return when no size is given
+
+class Cursor:
+    """
+    Records of an executed query, produced by the plan only as they are read: iterate it or fetch
+    a batch at a time, so exporting a large result only keeps one batch in memory
+    Example: for batch in QueryBuilder(orders).execute().as_columns(50000): writer.write(batch)
+    """
+    def __init__(self, records: Iterator[Dict[str, Any]]) -> None:
+        self._records = records
+        self.rowcount = 0 # Records read so far
+        
+    def __iter__(self) -> 'Cursor':
+        return self
+    
+    def __next__(self) -> Dict[str, Any]:
+        record = next(self._records)
+        self.rowcount += 1
+        return record
+    
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        return next(self, None)
+    
+    def fetchmany(self, size: int = CURSOR_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """The next size records, fewer at the end of the result and none after it"""
+        return list(islice(self, size))
+    
+    def fetchall(self) -> List[Dict[str, Any]]:
+        return list(self)
+    
+    def as_columns(self, size: int = CURSOR_BATCH_SIZE) -> Iterator[Dict[str, List[Any]]]:
+        """
+        The remaining records in batches of size, each one as a list of values per column
+        Example: as_columns(2) on select("id", "total")
+        Results: {"id": [1, 2], "total": [99.99, 149.99]}, then {"id": [3], "total": [5.0]}
+        """
+        while batch := self.fetchmany(size):
+            names = list(batch[0])
+            yield {name: [record.get(name) for record in batch] for name in names}
+            
+    def close(self) -> None:
+        """Stop the query without reading the rest of its records, releasing what the plan holds"""
+        close = getattr(self._records, "close", None)
+        if close is not None:
+            close()
+            
+    def __enter__(self) -> 'Cursor':
+        return self
+    
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+PREPARED_QUERIES_SIZE = 256 # Query shapes whose prepared query is kept
+_prepared_queries: 'OrderedDict[Tuple[Any, ...], PreparedQuery]' = OrderedDict() # By fingerprint, workers and memory budget
+_prepared_queries_lock = threading.Lock()
+
+class QueryBuilder:
+    def __init__(self, table: Table) -> None:
+        self.table = table
+        self._selected_columns: List[Union[ColumnSelector, str]] | Literal["*"] = "*"
+        self._avg: List[Union[ColumnSelector, str]] = []
+        self._sum: List[Union[ColumnSelector, str]] = []
+        self._count: List[Union[ColumnSelector, str]] = []
+        self._min: List[Union[ColumnSelector, str]] = []
+        self._max: List[Union[ColumnSelector, str]] = []
+        self._approx_count_distinct: List[Union[ColumnSelector, str]] = []
+        self._approx_avg: List[Union[ColumnSelector, str]] = []
+        self._approx_sum: List[Union[ColumnSelector, str]] = []
+        self._sample_rate = 1.0
+        self._confidence = 0.95
+        self._where_conditions: Dict[str, Any] = {}
+        self._group_by: List[str] = []
+        self._order_by: List[Union[OrderBySelector, str]] = []
+        self._limit_value: Optional[int] = None
+        self._offset_value: Optional[int] = None
+        self._is_distinct: bool = False
+        self._joins: List[JoinClause] = []
+        self._memory_budget: Optional[int] = DEFAULT_MEMORY_BUDGET
+        self._workers = 1
+        self._last_execution: Optional['QueryExecutor'] = None
+        self._result_cache: Optional['QueryCache'] = None
+        
+    def _transform_column_selector_union_to_str(self, args: tuple[Union[str, ColumnSelector | OrderBySelector], ...]) -> List[str]:
+        all_columns_and_fks_passed: List[str] = []
+        for arg in args:
+            if isinstance(arg, str):
+                all_columns_and_fks_passed.append(arg)
+            else:
+                all_columns_and_fks_passed.append(arg.column)
+        return all_columns_and_fks_passed
+    
+    def _validate_columns_existence(self, column_and_fk_names: List[str]) -> bool:
+        """Check if all the column names and fks passed are valid"""
+        column_repository = self.table.column_repository
+        return all(column for column in column_and_fk_names if column in column_repository)
+        
+    def select(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+        """
+        Add SELECT clause
+        
+        Example 1: select() or select(*)
+        Result 1: SELECT *
+        
+        Example 2: select("id", "name")
+        Result 2: SELECT id, name
+        
+        Example 3: select("id", { "column": "name", "alias": "first_name" })
+        Result 3: SELECT id, name as first_name
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                if isinstance(self._selected_columns, str):
+                    self._selected_columns = list(args)
+                else:
+                    self._selected_columns.extend(list(args))
+            else:
+                print("Make sure you pass only existing columns and foreign keys to SELECT")
+        
+        return self
+    
+    def avg(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+        """
+        Add AVG aggregate function
+        Example: avg("salary", { "column": "bonus", "alias": "average_bonus" })
+        Results: AVG(salary), AVG(bonus) AS average_bonus
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._avg.extend(list(args))
+            else:
+                print("Cannot AVG properties that don't exist")
+        
+        return self
+    
+    def sum(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+        """
+        Add SUM aggregate function
+        Example: sum("salary", { "column": "bonus", "alias": "total_bonus" }))
+        Results: SUM(salary), SUM(bonus) as total_bonus
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._sum.extend(list(args))
+            else:
+                print("Cannot SUM properties that don't exist")
+        
+        return self
+    
+    def count(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+        """
+        Add COUNT aggregate function
+        Example: count("*", ColumnSelector("email", "emails"))
+        Results: COUNT(*), COUNT(email) AS emails
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._count.extend(list(args))
+            else:
+                print("Cannot COUNT properties that don't exist")
+        
+        return self
+    
+    def min(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+        """
+        Add MIN aggregate function
+        Example: min("price", ColumnSelector("stock", "lowest_stock"))
+        Results: MIN(price), MIN(stock) AS lowest_stock
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._min.extend(list(args))
+            else:
+                print("Cannot MIN properties that don't exist")
+        
+        return self
+    
+    def max(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+        """
+        Add MAX aggregate function
+        Example: max("price", ColumnSelector("stock", "highest_stock"))
+        Results: MAX(price), MAX(stock) AS highest_stock
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._max.extend(list(args))
+            else:
+                print("Cannot MAX properties that don't exist")
+        
+        return self
+    
+    def approx_count_distinct(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+        """
+        Add an estimate of COUNT(DISTINCT column) kept in a fixed size HyperLogLog sketch
+        Example: approx_count_distinct("email", ColumnSelector("user_id", "buyers"))
+        Results: APPROX_COUNT_DISTINCT(email), APPROX_COUNT_DISTINCT(user_id) AS buyers
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._approx_count_distinct.extend(list(args))
+            else:
+                print("Cannot APPROX_COUNT_DISTINCT properties that don't exist")
+        
+        return self
+    
+    def approx_avg(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+        """
+        Add an AVG estimated from a sample of the rows (see sample), with its confidence interval
+        Example: approx_avg("total")
+        Results: APPROX_AVG(total)
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._approx_avg.extend(list(args))
+            else:
+                print("Cannot APPROX_AVG properties that don't exist")
+        
+        return self
+    
+    def approx_sum(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+        """
+        Add a SUM estimated from a sample of the rows (see sample), with its confidence interval
+        Example: approx_sum(ColumnSelector("total", "revenue"))
+        Results: APPROX_SUM(total) AS revenue
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._approx_sum.extend(list(args))
+            else:
+                print("Cannot APPROX_SUM properties that don't exist")
+        
+        return self
+    
+    def sample(self, rate: float, confidence: float = 0.95) -> 'QueryBuilder':
+        """
+        Set the fraction of rows APPROX_AVG and APPROX_SUM read and the confidence of their intervals.
+        When every aggregate is one of them, the scan itself only reads the sampled rows
+        Example: sample(0.01, confidence=0.99)
+        """
+        if not 0 < rate <= 1:
+            print("The sample rate must be greater than 0 and at most 1")
+            return self
+        if not 0 < confidence < 1:
+            print("The confidence must be between 0 and 1")
+            return self
+        
+        self._sample_rate = rate
+        self._confidence = confidence
+        return self
+    
+    def join(self, other_table: Table, on: Optional[Union[ForeignKey, str]] = None) -> 'QueryBuilder':
+        """
+        Add an inner JOIN along a foreign key, in either direction. Without on, the
+        foreign key between the tables of the query and other_table is looked up.
+        Columns of joined tables are also available as "table.column"
+        Example: QueryBuilder(orders).join(users)
+        Results: FROM orders JOIN users ON orders.user_id = users.id
+        """
+        tables = [self.table] + [join.table for join in self._joins]
+        on_name = on.name if isinstance(on, ForeignKey) else on
+        
+        for table in tables:
+            # The foreign key belongs to a table of the query and references other_table
+            for key in table.column_repository.foreign_keys:
+                if key.reference_table_name == other_table.table_name and on_name in (None, key.name):
+                    self._joins.append(JoinClause(other_table, key, table, key.name, key.reference_column_name))
+                    return self
+                
+            # The foreign key belongs to other_table and references a table of the query
+            for key in other_table.column_repository.foreign_keys:
+                if key.reference_table_name == table.table_name and on_name in (None, key.name):
+                    self._joins.append(JoinClause(other_table, key, table, key.reference_column_name, key.name))
+                    return self
+                
+        print(f"Cannot JOIN {other_table.table_name}: no foreign key connects it to the query")
+        return self
+    
+    def distinct(self, is_distinct: bool) -> 'QueryBuilder':
+        """
+        Add DISTINCT to a SELECT
+        Example: distinct(True)
+        Results: SELECT DISTINCT ...
+        """
+        self._is_distinct = is_distinct        
+
+        return self
+    
+    def where(self, **kwargs: Any) -> 'QueryBuilder':
+        """
+        Add WHERE clause
+        Example: where(name="John", age__gt=25)
+        Results: WHERE name = "John" AND age > 25
+        """
+        all_keys = [key for key, value in kwargs.items()]
+        is_input_valid = self._validate_columns_existence(all_keys)
+        
+        if is_input_valid:
+            for key, value in kwargs.items():
+                # Handle special operators (e.g., age__gt=25)
+                if "__" in key:
+                    field, operator = key.split("__")
+                    if operator in operators:
+                        self._where_conditions[field] = {
+                            "operator": operators[operator],
+                            "value": value
+                        }
+                else:
+                    # Handle simple equality
+                    self._where_conditions[key] = {
+                        "operator": "=",
+                        "value": value
+                    }
+        else:
+            print("Make sure you pass only existing fields to your WHERE clause")
+            
+        return self
+        
+    def order_by(self, *args: Union[str, OrderBySelector]) -> 'QueryBuilder':
+        """
+        Add ORDER BY clause
+        Example: order_by(name, { "column": "age", "is_desc": TRUE })
+        Results: ORDER BY name, age DESC
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._order_by.extend(list(args))
+            else:
+                print("Cannot ORDER BY properties that don't exist")
+                
+        return self
+    
+    def group_by(self, *args: str) -> 'QueryBuilder':
+        """
+        Add GROUP BY clause
+        Example: group_by("department")
+        Results: GROUP BY department
+        """
+        if args:
+            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
+            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+            
+            if is_input_valid:
+                self._group_by.extend(list(args))
+            else:
+                print("Cannot GROUP BY properties that don't exist")
+                
+        return self
+    
+    def limit(self, value: int) -> 'QueryBuilder':
+        """
+        Add LIMIT clause
+        Example: limit(5)
+        Results: LIMIT 5
+        """
+        self._limit_value = value
+        return self
+    
+    def offset(self, value: int) -> 'QueryBuilder':
+        """
+        Add OFFSET clause
+        Example: offset(10)
+        Results OFFSET 10
+        """
+        self._offset_value = value
+        return self
+    
+    def memory_budget(self, value: Optional[int]) -> 'QueryBuilder':
+        """
+        Set how many bytes of records a sort keeps in memory before spilling sorted runs to disk.
+        None never spills
+        Example: memory_budget(64 * 1024 * 1024)
+        """
+        self._memory_budget = value
+        return self
+    
+    def parallel(self, workers: Optional[int] = None) -> 'QueryBuilder':
+        """
+        Scan the table in partitions with a pool of worker processes, None uses one per CPU core.
+        Filters, aggregates and ORDER BY ... LIMIT run in the workers and their partial results are merged.
+        Queries with JOIN or reading an index stay in this process
+        Example: parallel(8)
+        """
+        workers = (os.cpu_count() or 1) if workers is None else workers
+        if workers < 1:
+            print("The number of workers must be at least 1")
+            return self
+        
+        self._workers = workers
+        return self
+    
+    def execute(self) -> Cursor:
+        """
+        Run the query against the rows stored in the table
+        Example: execute() on select("name").where(price__gt=100)
+        Results: a Cursor over the {"name": ...} records, produced one at a time
+        """
+        if self.parameters():
+            raise ValueError(f"Queries with parameters run through prepare().execute(), missing: {', '.join(self.parameters())}")
+        if self._result_cache is None:
+            self._last_execution = QueryExecutor(self)
+            return Cursor(self._last_execution.execute())
+        
+        key = self.fingerprint()
+        versions = tuple(table.version for table in self._tables())
+        records = self._result_cache.get(key, versions)
+        if records is None:
+            self._last_execution = QueryExecutor(self)
+            records = list(self._last_execution.execute())
+            self._result_cache.put(key, versions, records)
+        else:
+            self._last_execution = None
+        # Copies, so callers changing a record don't change the cached result
+        return Cursor(dict(record) for record in records)
+    
+    def parameters(self) -> List[str]:
+        """Names of the Param placeholders of the WHERE clause"""
+        return [details["value"].name for details in self._where_conditions.values() if isinstance(details["value"], Param)]
+    
+    def prepare(self) -> 'PreparedQuery':
+        """
+        Get the prepared query of this query's shape: its SQL is rendered and its plan built once,
+        and every execution only binds the values of its Param placeholders.
+        Builders of the same shape share one, so building the query again per request is enough
+        Example: prepare() on select("name").where(price__gt=Param("min_price")), then execute(min_price=100)
+        """
+        # Workers and the memory budget don't change the result, but a prepared query runs with them
+        key = (self.fingerprint(), self._workers, self._memory_budget)
+        with _prepared_queries_lock:
+            prepared = _prepared_queries.get(key)
+            if prepared is not None:
+                _prepared_queries.move_to_end(key)
+                return prepared
+            
+        prepared = PreparedQuery(self)
+        with _prepared_queries_lock:
+            prepared = _prepared_queries.setdefault(key, prepared)
+            while len(_prepared_queries) > PREPARED_QUERIES_SIZE:
+                _prepared_queries.popitem(last=False)
+        return prepared
+    
+    def cache(self, result_cache: Optional['QueryCache']) -> 'QueryBuilder':
+        """
+        Serve the results of execute() from a QueryCache while none of the queried tables changed.
+        None stops caching
+        Example: cache(dashboard_cache)
+        """
+        self._result_cache = result_cache
+        return self
+    
+    def _tables(self) -> List[Table]:
+        return [self.table] + [join.table for join in self._joins]
+    
+    def _where_key(self) -> Tuple[Any, ...]:
+        """The WHERE conditions in a canonical, hashable form"""
+        def hashable(value: Any) -> Any:
+            if isinstance(value, (list, tuple, set, frozenset)):
+                items = [hashable(item) for item in value]
+                try:
+                    return frozenset(items)
+                except TypeError:
+                    return tuple(items)
+            try:
+                hash(value)
+                return value
+            except TypeError:
+                return repr(value)
+            
+        return tuple(sorted(
+            ((field, details["operator"], hashable(details["value"])) for field, details in self._where_conditions.items()),
+            key=itemgetter(0)
+        ))
+    
+    def fingerprint(self) -> Tuple[Any, ...]:
+        """
+        Canonical key of everything that decides the result of the query, equal for builders
+        that only differ in the order of their WHERE conditions or IN values
+        """
+        def selectors(values: Any) -> Tuple[Any, ...]:
+            if values == "*":
+                return ("*",)
+            return tuple(
+                (value, None) if isinstance(value, str) else (value.column, value.alias)
+                for value in values
+            )
+        
+        return (
+            tuple((id(table), table.table_name) for table in self._tables()),
+            tuple((join.left_table.table_name, join.left_column, join.right_column) for join in self._joins),
+            selectors(self._selected_columns),
+            tuple((function, selectors(values)) for function, values in self._aggregate_selectors()),
+            self._where_key(),
+            tuple(self._group_by),
+            tuple(
+                (value, False) if isinstance(value, str) else (value.column, value.is_desc)
+                for value in self._order_by
+            ),
+            self._limit_value,
+            self._offset_value,
+            self._is_distinct,
+            self._sample_rate,
+            self._confidence
+        )
+    
+    def explain(self, analyze: bool = False) -> str:
+        """
+        Print the plan execute() would run, one step per line with its estimated number of rows.
+        With analyze the query is run and every step also reports its actual rows and time
+        Example: explain(analyze=True) on select("name").where(price__gt=100)
+        Results: Project name (estimated rows=12, actual rows=9, time=0.210 ms)
+                   -> TableScan on products filter: price > 100 (estimated rows=12, actual rows=9, time=0.180 ms)
+        """
+        executor = QueryExecutor(self)
+        plan = executor.build_plan()
+        if analyze:
+            plan = analyze_plan(plan)
+            for _ in plan:
+                pass
+            self._last_execution = executor
+            
+        text = format_plan(plan)
+        print(text)
+        return text
+    
+    @property
+    def blocks_pruned(self) -> int:
+        """Blocks of rows the zone maps let the last execute() skip, known once its results are read"""
+        if self._last_execution is None:
+            return 0
+        return sum(scan.blocks_pruned for scan in self._last_execution.scans)
+    
+    def _aggregate_selectors(self) -> List[Tuple[str, List[Union[ColumnSelector, str]]]]:
+        return [
+            ("AVG", self._avg),
+            ("SUM", self._sum),
+            ("COUNT", self._count),
+            ("MIN", self._min),
+            ("MAX", self._max),
+            ("APPROX_COUNT_DISTINCT", self._approx_count_distinct),
+            ("APPROX_AVG", self._approx_avg),
+            ("APPROX_SUM", self._approx_sum)
+        ]
+    
+    def _format_value(self, value: Any) -> str:
+        """Format values based on their type"""
+        if isinstance(value, str):
+            return f"'{value}'"
+        elif isinstance(value, datetime):
+            return f"'{value.strftime("%Y-%m-%d %H:%M:%S")}'"
+        elif isinstance(value, (list, tuple)):
+            return f"({", ".join(map(self._format_value, value))})"
+        return str(value)
+    
+    def __str__(self) -> str:
+        """Convert the query to SQL string"""
+        return self.to_sql(self._format_value)
+    
+    def to_sql(self, format_value: Callable[[Any], str]) -> str:
+        """The SQL of the query with every WHERE value written by format_value, e.g. as a placeholder"""
+        distinct = "DISTINCT " if self._is_distinct else ""
+        
+        has_aggregates = any(conditions for _, conditions in self._aggregate_selectors())
+        
+        if self._selected_columns == "*" and not has_aggregates:
+            sql = f"SELECT {distinct}*"
+        else:
+            select_conditions: List[str] = []
+            
+            # With aggregates, * stands for the grouped columns, the only ones with one value per group
+            selected = self._group_by if self._selected_columns == "*" else self._selected_columns
+            for condition in selected:
+                if isinstance(condition, str):
+                    select_conditions.append(condition)
+                else:
+                    if condition.alias:
+                        select_conditions.append(f"{condition.column} AS {condition.alias}")
+                    else:
+                        select_conditions.append(condition.column)
+                        
+            for function, conditions in self._aggregate_selectors():
+                for condition in conditions:
+                    if isinstance(condition, str):
+                        select_conditions.append(f"{function}({condition})")
+                    else:
+                        if condition.alias:
+                            select_conditions.append(f"{function}({condition.column}) AS {condition.alias}")
+                        else:
+                            select_conditions.append(f"{function}({condition.column})")
+            
+            sql = f"SELECT {distinct}{", ".join(select_conditions)}"
+            
+        sql += f"\nFROM {self.table.table_name}"
+        
+        for join in self._joins:
+            sql += f"\nJOIN {join.table.table_name} ON {join.left_table.table_name}.{join.left_column} = {join.table.table_name}.{join.right_column}"
+        
+        if self._where_conditions:
+            where_conditions: List[str] = []
+             
+            for field, details in self._where_conditions.items():
+                operator = details["operator"]
+                value = format_value(details["value"])
+                where_conditions.append(f"{field} {operator} {value}")
+                
+            sql += "\nWHERE " + " AND ".join(where_conditions)
+            
+        if self._group_by:
+            sql +="\nGROUP BY " + ", ".join(self._group_by)
+            
+        if self._order_by:
+            order_by_conditions: List[str] = []
+            
+            for condition in self._order_by: # type: ignore
+                if isinstance(condition, str):
+                    order_by_conditions.append(condition)
+                elif isinstance(condition, OrderBySelector):
+                    if condition.is_desc:
+                        order_by_conditions.append(f"{condition.column} DESC")
+                    else:
+                        order_by_conditions.append(condition.column)
+            
+            sql += "\nORDER BY " + ", ".join(order_by_conditions)
+            
+        if self._limit_value:
+            sql += f"\nLIMIT {self._limit_value}"
+            
+        if self._offset_value:
+            # SQLite only takes OFFSET after a LIMIT, and -1 means no limit
+            if not self._limit_value:
+                sql += "\nLIMIT -1"
+            sql += f"\nOFFSET {self._offset_value}"
+            
+        return sql
 
-EQ = "eq"
-GT = "gt"
-LT = "lt"
-GTE = "gte"
-LTE = "lte"
-LIKE = "like"
-IN = "in"
+class Accumulator(ABC):
+    """Running result of one aggregate function for one group, updated one value at a time"""
+    @abstractmethod
+    def add(self, value: Any) -> None:
+        pass
+    
+    @abstractmethod
+    def state(self) -> Any:
+        """Partial result that another worker can merge"""
+        pass
+    
+    @abstractmethod
+    def merge(self, state: Any) -> None:
+        pass
+    
+    @abstractmethod
+    def result(self) -> Any:
+        pass
+    
+class SumAccumulator(Accumulator):
+    def __init__(self) -> None:
+        self.total: Any = None
+        
+    def add(self, value: Any) -> None:
+        self.total = value if self.total is None else self.total + value
+        
+    def state(self) -> Any:
+        return self.total
+    
+    def merge(self, state: Any) -> None:
+        if state is not None:
+            self.add(state)
+            
+    def result(self) -> Any:
+        return self.total
+    
+class CountAccumulator(Accumulator):
+    def __init__(self) -> None:
+        self.count = 0
+        
+    def add(self, value: Any) -> None:
+        self.count += 1
+        
+    def state(self) -> Any:
+        return self.count
+    
+    def merge(self, state: Any) -> None:
+        self.count += state
+        
+    def result(self) -> Any:
+        return self.count
+    
+class AvgAccumulator(Accumulator):
+    def __init__(self) -> None:
+        self.total: Any = 0
+        self.count = 0
+        
+    def add(self, value: Any) -> None:
+        self.total += value
+        self.count += 1
+        
+    def state(self) -> Any:
+        return (self.total, self.count)
+    
+    def merge(self, state: Any) -> None:
+        self.total += state[0]
+        self.count += state[1]
+        
+    def result(self) -> Any:
+        return self.total / self.count if self.count else None
+    
+class MinAccumulator(Accumulator):
+    def __init__(self) -> None:
+        self.value: Any = None
+        
+    def add(self, value: Any) -> None:
+        if self.value is None or value < self.value:
+            self.value = value
+            
+    def state(self) -> Any:
+        return self.value
+    
+    def merge(self, state: Any) -> None:
+        if state is not None:
+            self.add(state)
+            
+    def result(self) -> Any:
+        return self.value
+    
+class MaxAccumulator(MinAccumulator):
+    def add(self, value: Any) -> None:
+        if self.value is None or value > self.value:
+            self.value = value
 
-operators = {
-    EQ: '=',
-    GT: '>',
-    LT: '<',
-    GTE: '>=',
-    LTE: '<=',
-    LIKE: 'LIKE',
-    IN: 'IN'
+HLL_PRECISION = 12 # 2^12 one byte registers per sketch, a standard error of about 1.6%
+
+class HyperLogLogAccumulator(Accumulator):
+    """
+    Estimate of the number of distinct values in 2^HLL_PRECISION bytes, however many values it sees.
+    Every register keeps the longest run of leading zero bits among the hashes routed to it,
+    and sketches of partitions merge by keeping the larger register
+    """
+    def __init__(self) -> None:
+        self.registers = bytearray(1 << HLL_PRECISION)
+        
+    def add(self, value: Any) -> None:
+        # A stable hash, so that sketches built by other processes agree
+        hashed = int.from_bytes(hashlib.blake2b(repr(value).encode("utf-8"), digest_size=8).digest(), "big")
+        register = hashed >> (64 - HLL_PRECISION)
+        rank = 64 - HLL_PRECISION - (hashed & ((1 << (64 - HLL_PRECISION)) - 1)).bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+            
+    def state(self) -> Any:
+        return bytes(self.registers)
+    
+    def merge(self, state: Any) -> None:
+        self.registers = bytearray(map(max, self.registers, state))
+        
+    def result(self) -> Any:
+        size = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / size) * size * size / sum(2.0 ** -register for register in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * size and empty:
+            # Few values: counting the empty registers is more accurate
+            estimate = size * math.log(size / empty)
+        return round(estimate)
+    
+@dataclass(frozen=True, order=True)
+class Estimate:
+    """Result of an approximate aggregate with its confidence interval"""
+    value: float
+    low: float
+    high: float
+    
+class SampledAccumulator(Accumulator):
+    """
+    Estimate from a Bernoulli sample of the values, keeping only the count, sum and sum of squares
+    of the sampled values (so partitions merge by adding them). When the scan didn't sample the
+    rows already, every value is kept with probability sample_rate
+    """
+    def __init__(self, sample_rate: float = 1.0, confidence: float = 0.95, rows_sampled: bool = False) -> None:
+        self.sample_rate = sample_rate
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.sample_values = sample_rate < 1 and not rows_sampled
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        
+    def add(self, value: Any) -> None:
+        if self.sample_values and random.random() >= self.sample_rate:
+            return
+        self.count += 1
+        self.total += value
+        self.squares += value * value
+        
+    def state(self) -> Any:
+        return self.count, self.total, self.squares
+    
+    def merge(self, state: Any) -> None:
+        count, total, squares = state
+        self.count += count
+        self.total += total
+        self.squares += squares
+        
+class ApproxSumAccumulator(SampledAccumulator):
+    def result(self) -> Any:
+        if not self.count:
+            return None
+        value = self.total / self.sample_rate
+        # Variance of the Horvitz-Thompson estimator of a total under Bernoulli sampling
+        margin = self.z * math.sqrt((1 - self.sample_rate) * self.squares) / self.sample_rate
+        return Estimate(value, value - margin, value + margin)
+    
+class ApproxAvgAccumulator(SampledAccumulator):
+    def result(self) -> Any:
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        if self.sample_rate >= 1:
+            return Estimate(mean, mean, mean)
+        if self.count < 2:
+            return Estimate(mean, -math.inf, math.inf)
+        variance = max(self.squares - self.count * mean * mean, 0.0) / (self.count - 1)
+        margin = self.z * math.sqrt(variance / self.count * (1 - self.sample_rate))
+        return Estimate(mean, mean - margin, mean + margin)
+    
+accumulators: Dict[str, Type[Accumulator]] = {
+    "AVG": AvgAccumulator,
+    "SUM": SumAccumulator,
+    "COUNT": CountAccumulator,
+    "MIN": MinAccumulator,
+    "MAX": MaxAccumulator,
+    "APPROX_COUNT_DISTINCT": HyperLogLogAccumulator,
+    "APPROX_AVG": ApproxAvgAccumulator,
+    "APPROX_SUM": ApproxSumAccumulator
 }
 
-@dataclass
-class ColumnSelector:
-    column: str
-    alias: Optional[str]
+def bernoulli_sample(row_ids: range, rate: float) -> List[int]:
+    """Keep every row id with probability rate, jumping a geometric distance instead of drawing once per row"""
+    sampled: List[int] = []
+    log_skip = math.log(1 - rate)
+    position = row_ids.start - 1
+    while True:
+        position += 1 + int(math.log(1.0 - random.random()) / log_skip)
+        if position >= row_ids.stop:
+            return sampled
+        sampled.append(position)
+
+def format_conditions(conditions: List[Tuple[str, str, Any]]) -> str:
+    return " AND ".join(f"{field} {operator} {value!r}" for field, operator, value in conditions)
+
+def format_order_by(order_by: List[Tuple[str, bool]]) -> str:
+    return ", ".join(f"{column} DESC" if is_desc else column for column, is_desc in order_by)
+
+class Operator(ABC):
+    """A step of the execution plan. Iterating it streams records (column name -> value) to the parent step"""
+    estimated_rows: Optional[float] = None # Set by the planner
     
-@dataclass
-class OrderBySelector:
-    column: str
-    is_desc: bool = False
+    @abstractmethod
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        pass
+    
+    def children(self) -> List['Operator']:
+        """Steps this one reads records from"""
+        return [value for value in vars(self).values() if isinstance(value, Operator)]
+    
+    def describe(self) -> str:
+        """One line summary of the step, for EXPLAIN"""
+        return type(self).__name__
+    
+    def bind(self, parameters: Dict[str, Any]) -> 'Operator':
+        """Copy of the step and the steps under it with the Param placeholders replaced by their values"""
+        bound = copy.copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, Operator):
+                setattr(bound, name, value.bind(parameters))
+        return bound
 
-class QueryBuilder:
-    def __init__(self, table: Table) -> None:
+SCAN_BATCH_SIZE = 65536 # Row ids a table scan hands to the repository at once
+
+class TableScan(Operator):
+    """
+    Reads every stored row of a table, converting values to the Python type of their column.
+    Conditions pushed into the scan are evaluated by the repository before records are built
+    """
+    def __init__(
+        self,
+        table: Table,
+        column_names: Optional[Set[str]] = None,
+        conditions: Optional[List[Tuple[str, str, Any]]] = None
+    ) -> None:
         self.table = table
-        self._selected_columns: List[Union[ColumnSelector, str]] | Literal["*"] = "*"
-        self._avg: List[Union[ColumnSelector, str]] = []
-        self._sum: List[Union[ColumnSelector, str]] = []
-        self._where_conditions: Dict[str, Any] = {}
-        self._group_by: List[str] = []
-        self._order_by: List[Union[OrderBySelector, str]] = []
-        self._limit_value: Optional[int] = None
-        self._offset_value: Optional[int] = None
-        self._is_distinct: bool = False
+        self.column_names = column_names # Columns the query uses, None reads all of them
+        self.conditions = conditions or []
+        self.row_ids: Optional[range] = None # Partition of the rows to read, None reads all of them
+        self.encoded_columns: Set[str] = set() # Dictionary encoded columns read as their codes
+        self.sample_rate = 1.0 # Fraction of the rows read, each one kept independently
+        self.blocks_pruned = 0
         
-    def _transform_column_selector_union_to_str(self, args: tuple[Union[str, ColumnSelector | OrderBySelector], ...]) -> List[str]:
-        all_columns_and_fks_passed: List[str] = []
-        for arg in args:
-            if isinstance(arg, str):
-                all_columns_and_fks_passed.append(arg)
-            else:
-                all_columns_and_fks_passed.append(arg.column)
-        return all_columns_and_fks_passed
+    def partition(self, row_ids: range) -> 'TableScan':
+        """Same scan limited to a range of row ids"""
+        scan = TableScan(self.table, self.column_names, self.conditions)
+        scan.row_ids = row_ids
+        scan.encoded_columns = self.encoded_columns
+        scan.sample_rate = self.sample_rate
+        return scan
     
-    def _validate_columns_existence(self, column_and_fk_names: List[str]) -> bool:
-        """Check if all the column names and fks passed are valid"""
-        all_column_names = [column.name for column in self.table.column_repository.columns]
-        all_fk_names = [fk.name for fk in self.table.column_repository.foreign_keys]
-        all_possible_columns = all_column_names + all_fk_names
+    def bind(self, parameters: Dict[str, Any]) -> 'Operator':
+        bound = copy.copy(self)
+        bound.conditions = bind_conditions(self.conditions, parameters)
+        return bound
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        columns = self.table.column_repository.columns
+        foreign_keys = self.table.column_repository.foreign_keys
+        if self.column_names is not None:
+            # Looked up by name, so that a scan of a few columns costs the same however wide the table is
+            repository = self.table.column_repository
+            names = sorted(self.column_names)
+            columns = [column for column in map(repository.column, names) if column is not None]
+            foreign_keys = [key for key in map(repository.foreign_key, names) if key is not None]
+        # Taken once, so every batch reads the same encoding even if a column switches to plain text meanwhile
+        encoded = self.table.row_repository.code_readers(self.encoded_columns) if self.encoded_columns else {}
+            
+        for row_ids in self.ranges():
+            # In batches, so that the ids matching the conditions never have to be held for the whole table
+            for start in range(row_ids.start, row_ids.stop, SCAN_BATCH_SIZE):
+                batch = range(start, min(start + SCAN_BATCH_SIZE, row_ids.stop))
+                scanned: Union[range, List[int]] = batch if self.sample_rate >= 1 else bernoulli_sample(batch, self.sample_rate)
+                yield from self.table.row_repository.records(columns, foreign_keys, self.conditions, scanned, encoded)
+            
+    def ranges(self) -> List[range]:
+        """Ranges of row ids to read once the zone maps have skipped the blocks no condition can match"""
+        row_ids = self.row_ids if self.row_ids is not None else range(self.table.row_repository.next_row_id)
+        if not self.conditions:
+            return [row_ids]
+        ranges, self.blocks_pruned = self.table.prune_blocks(self.conditions, row_ids)
+        return ranges
+    
+    def describe(self) -> str:
+        description = f"TableScan on {self.table.table_name}"
+        if self.conditions:
+            description += f" filter: {format_conditions(self.conditions)}"
+        if self.sample_rate < 1:
+            description += f" sample: {self.sample_rate:.2%}"
+        if self.blocks_pruned:
+            description += f" blocks pruned: {self.blocks_pruned}"
+        return description
         
-        return all(column for column in column_and_fk_names if column in all_possible_columns)
+PARTITION_SIZE = 100000 # Rows scanned by one task of a parallel scan
+
+# Scans being run by a pool. Forked workers inherit them together with the stored rows and
+# column buffers (copy-on-write memory), so neither the plan nor the data is pickled
+_parallel_scans: Dict[int, 'ParallelScan'] = {}
+
+def _run_partition(scan_id: int, start: int, stop: int) -> List[Dict[str, Any]]:
+    parallel_scan = _parallel_scans[scan_id]
+    return list(parallel_scan.partial_plan(parallel_scan.scan.partition(range(start, stop))))
+
+class ParallelScan(Operator):
+    """
+    Splits a table scan into partitions of PARTITION_SIZE row ids that a pool of worker
+    processes scans in parallel. Each worker runs partial_plan over its partition (e.g. a
+    partial aggregation or a top-K) and only those partial results are sent back and
+    streamed to the parent step, which merges them.
+    Without the fork start method (or with a single partition) the partitions run one after the other here
+    """
+    def __init__(self, scan: TableScan, partial_plan: Callable[[Operator], Operator], workers: int) -> None:
+        self.scan = scan
+        self.partial_plan = partial_plan
+        self.workers = workers
         
-    def select(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
-        """
-        Add SELECT clause
+    def children(self) -> List[Operator]:
+        # The scan only describes the partitions, it is never read as a whole
+        return []
+    
+    def describe(self) -> str:
+        return f"ParallelScan ({self.workers} workers) over {self.scan.describe()}"
         
-        Example 1: select() or select(*)
-        Result 1: SELECT *
+    def _partitions(self) -> List[range]:
+        return [
+            range(start, min(start + PARTITION_SIZE, row_ids.stop))
+            for row_ids in self.scan.ranges()
+            for start in range(row_ids.start, row_ids.stop, PARTITION_SIZE)
+        ]
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        partitions = self._partitions()
+        if len(partitions) < 2 or self.workers < 2 or "fork" not in multiprocessing.get_all_start_methods():
+            for row_ids in partitions:
+                yield from self.partial_plan(self.scan.partition(row_ids))
+            return
         
-        Example 2: select("id", "name")
-        Result 2: SELECT id, name
+        scan_id = id(self)
+        _parallel_scans[scan_id] = self
+        try:
+            workers = min(self.workers, len(partitions))
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+                # Only a few partitions ahead of the one being read, so results wait in memory for a slow reader
+                remaining = iter(partitions)
+                tasks = deque(pool.submit(_run_partition, scan_id, row_ids.start, row_ids.stop) for row_ids in islice(remaining, 2 * workers))
+                while tasks:
+                    records = tasks.popleft().result()
+                    row_ids = next(remaining, None)
+                    if row_ids is not None:
+                        tasks.append(pool.submit(_run_partition, scan_id, row_ids.start, row_ids.stop))
+                    yield from records
+        finally:
+            del _parallel_scans[scan_id]
+
+class IndexScan(Operator):
+    """Reads only the rows an index returns for a WHERE condition"""
+    def __init__(self, table: Table, index: Index, operator: str, value: Any) -> None:
+        self.table = table
+        self.index = index
+        self.operator = operator
+        self.value = value
         
-        Example 3: select("id", { "column": "name", "alias": "first_name" })
-        Result 3: SELECT id, name as first_name
-        """
-        if args:
-            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
-            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        columns = self.table.column_repository.columns
+        foreign_keys = self.table.column_repository.foreign_keys
+        for row_id in self.index.lookup(self.operator, self.value):
+            yield self.table.row_repository.record(row_id, columns, foreign_keys)
             
-            if is_input_valid:
-                if isinstance(self._selected_columns, str):
-                    self._selected_columns = list(args)
+    def bind(self, parameters: Dict[str, Any]) -> 'Operator':
+        bound = copy.copy(self)
+        if isinstance(self.value, Param):
+            bound.value = self.value.bind(parameters)
+        return bound
+            
+    def describe(self) -> str:
+        return (
+            f"IndexScan on {self.table.table_name} using {self.index.kind} index on {self.index.column_name}"
+            f" cond: {format_conditions([(self.index.column_name, self.operator, self.value)])}"
+        )
+            
+class IndexOrderScan(Operator):
+    """Reads the rows in the order of a sorted index, so ORDER BY ... LIMIT stops after the first rows"""
+    def __init__(self, table: Table, index: SortedIndex, is_desc: bool) -> None:
+        self.table = table
+        self.index = index
+        self.is_desc = is_desc
+        
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        columns = self.table.column_repository.columns
+        foreign_keys = self.table.column_repository.foreign_keys
+        for row_id in self.index.ordered(self.is_desc):
+            yield self.table.row_repository.record(row_id, columns, foreign_keys)
+            
+    def describe(self) -> str:
+        order_by = format_order_by([(self.index.column_name, self.is_desc)])
+        return f"IndexOrderScan on {self.table.table_name} using sorted index on {self.index.column_name} order: {order_by}"
+
+class HashJoin(Operator):
+    """
+    Inner join on one key per side. The smaller input is loaded into a hash table (build)
+    and the other one streams through it (probe), so both sides are read once.
+    Joined records hold every right column as "table.column" and, unless the left side
+    already has that name, as a plain column
+    """
+    def __init__(
+        self,
+        left: Operator,
+        right: Operator,
+        left_key: str,
+        right_key: str,
+        right_table_name: str,
+        left_table_name: Optional[str] = None,
+        build_left: bool = False
+    ) -> None:
+        self.left = left
+        self.right = right
+        self.left_key = left_key
+        self.right_key = right_key
+        self.right_table_name = right_table_name
+        self.left_table_name = left_table_name # Set when the left records still need "table.column" names
+        self.build_left = build_left
+        
+    def _merge(self, left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+        merged = {f"{self.right_table_name}.{name}": value for name, value in right.items()}
+        if self.left_table_name:
+            merged.update({f"{self.left_table_name}.{name}": value for name, value in left.items()})
+        for name, value in right.items():
+            merged.setdefault(name, value)
+        merged.update(left)
+        return merged
+        
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self.build_left:
+            build, build_key, probe, probe_key = self.left, self.left_key, self.right, self.right_key
+        else:
+            build, build_key, probe, probe_key = self.right, self.right_key, self.left, self.left_key
+            
+        hash_table: Dict[Any, List[Dict[str, Any]]] = {}
+        for record in build:
+            key = record.get(build_key)
+            if key is not None:
+                hash_table.setdefault(key, []).append(record)
+                
+        for record in probe:
+            for match in hash_table.get(record.get(probe_key), ()):
+                if self.build_left:
+                    yield self._merge(match, record)
                 else:
-                    self._selected_columns.extend(list(args))
-            else:
-                print("Make sure you pass only existing columns and foreign keys to SELECT")
+                    yield self._merge(record, match)
+                    
+    def describe(self) -> str:
+        build = "left" if self.build_left else "right"
+        return f"HashJoin {self.right_table_name} on {self.left_key} = {self.right_key} (build {build})"
+
+class Filter(Operator):
+    """Keeps only the records matching every WHERE condition"""
+    def __init__(self, child: Operator, conditions: List[Tuple[str, str, Any]]) -> None:
+        self.child = child
+        self.conditions = conditions # (field, operator, value)
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        yield from filter(compile_predicate(self.conditions), self.child)
+        
+    def bind(self, parameters: Dict[str, Any]) -> 'Operator':
+        bound = Filter(self.child.bind(parameters), bind_conditions(self.conditions, parameters))
+        bound.estimated_rows = self.estimated_rows
+        return bound
+        
+    def describe(self) -> str:
+        return f"Filter {format_conditions(self.conditions)}"
+
+class HashAggregate(Operator):
+    """
+    Groups records by the GROUP BY columns in a hash table and updates running accumulators,
+    so every record is read once and only one state per group is kept.
+    
+    The "partial" mode outputs the accumulator states instead of results and the "final"
+    mode merges those states, which splits an aggregation between workers.
+    
+    GROUP BY columns read as dictionary codes are grouped on the codes and decoded
+    with their dictionary (code -> value) once per group. A scan that opened after the
+    column switched to plain text reads the values themselves, which are left as they are
+    """
+    def __init__(
+        self,
+        child: Operator,
+        group_by: List[str],
+        aggregates: List[Tuple[str, str, str]],
+        mode: Literal["complete", "partial", "final"] = "complete",
+        dictionaries: Optional[Dict[str, List[str]]] = None,
+        sample_rate: float = 1.0,
+        confidence: float = 0.95,
+        rows_sampled: bool = False
+    ) -> None:
+        self.child = child
+        self.group_by = group_by
+        self.aggregates = aggregates # (function, column, output name). COUNT(*) uses the column "*"
+        self.mode = mode
+        self.dictionaries = dictionaries or {}
+        # Options of APPROX_AVG and APPROX_SUM, rows_sampled when the scan only read sampled rows
+        self.sample_rate = sample_rate
+        self.confidence = confidence
+        self.rows_sampled = rows_sampled
+        
+    def _factory(self, function: str) -> Callable[[], Accumulator]:
+        factory = accumulators[function]
+        if issubclass(factory, SampledAccumulator):
+            return lambda: factory(self.sample_rate, self.confidence, self.rows_sampled)
+        return factory
+    
+    def _decode(self, record: Dict[str, Any]) -> None:
+        for column, dictionary in self.dictionaries.items():
+            value = record.get(column)
+            if isinstance(value, int):
+                record[column] = dictionary[value]
+    
+    def _group_key(self) -> Callable[[Dict[str, Any]], Any]:
+        if len(self.group_by) == 1:
+            column = self.group_by[0]
+            return lambda record: record.get(column)
+        return lambda record: tuple(record.get(column) for column in self.group_by)
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        group_key = self._group_key()
+        factories = [self._factory(function) for function, _, _ in self.aggregates]
+        # COUNT(*) counts every record, so it reads a value that is never NULL
+        inputs = [
+            (name, True) if self.mode == "final" else (column, True if column == "*" else None)
+            for _, column, name in self.aggregates
+        ]
+        # Non aggregated columns take their value from the first record of the group
+        groups: Dict[Any, Tuple[Dict[str, Any], List[Accumulator]]] = {}
+        
+        for record in self.child:
+            if self.mode == "final" and self.dictionaries:
+                # The partitions may have been read with different encodings, so their groups are merged on values
+                self._decode(record)
+            key = group_key(record)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (record, [factory() for factory in factories])
+                
+            if self.mode == "final":
+                for accumulator, (name, _) in zip(group[1], inputs):
+                    accumulator.merge(record[name])
+                continue
+            
+            for accumulator, (column, default) in zip(group[1], inputs):
+                value = record.get(column, default)
+                if value is not None:
+                    accumulator.add(value)
+                    
+        if not groups and not self.group_by:
+            # Aggregating nothing still produces a single row (COUNT is 0, the rest NULL)
+            groups[None] = ({}, [factory() for factory in factories])
+            
+        for first_record, group_accumulators in groups.values():
+            result = dict(first_record)
+            for (_, _, name), accumulator in zip(self.aggregates, group_accumulators):
+                result[name] = accumulator.state() if self.mode == "partial" else accumulator.result()
+            if self.mode == "complete":
+                self._decode(result)
+            yield result
+            
+    def describe(self) -> str:
+        description = f"HashAggregate ({self.mode})"
+        if self.group_by:
+            description += f" group by: {', '.join(self.group_by)}"
+        if self.aggregates:
+            description += f" computing: {', '.join(name for _, _, name in self.aggregates)}"
+        return description
+    
+class SortKey:
+    """
+    Orders records by several ORDER BY columns with mixed directions, the same way Sort does:
+    NULLs are the smallest value, so they come first ascending and last descending
+    """
+    __slots__ = ("values", "descending")
+    
+    def __init__(self, values: Tuple[Any, ...], descending: Tuple[bool, ...]) -> None:
+        self.values = values
+        self.descending = descending
+        
+    def __lt__(self, other: 'SortKey') -> bool:
+        for value, other_value, is_desc in zip(self.values, other.values, self.descending):
+            if value == other_value:
+                continue
+            if value is None:
+                return not is_desc
+            if other_value is None:
+                return is_desc
+            return value > other_value if is_desc else value < other_value
+        return False
+    
+    def __eq__(self, other: object) -> bool:
+        # heapq compares (key, position) pairs, which checks keys for equality before ordering them
+        return isinstance(other, SortKey) and self.values == other.values
+    
+def order_by_key(order_by: List[Tuple[str, bool]]) -> Tuple[Callable[[Dict[str, Any]], Any], bool]:
+    """
+    Key function ordering records like Sort, and whether it has to be applied in reverse.
+    With one direction for every column plain tuples are used, they compare much faster than SortKey
+    """
+    columns = [column for column, _ in order_by]
+    directions = {is_desc for _, is_desc in order_by}
+    
+    if len(directions) == 1:
+        return lambda record: tuple((record.get(column) is not None, record.get(column)) for column in columns), True in directions
+    
+    descending = tuple(is_desc for _, is_desc in order_by)
+    return lambda record: SortKey(tuple(record.get(column) for column in columns), descending), False
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024 # Bytes of records a sort keeps in memory before spilling to disk
+SPILL_CHUNK_SIZE = 1000 # Records pickled together in a spilled run
+
+def estimate_record_size(record: Dict[str, Any]) -> int:
+    """Approximate number of bytes a record takes in memory"""
+    return sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record.values())
+
+class Sort(Operator):
+    """
+    Sorts all records by the ORDER BY columns. NULLs come first in ascending order.
+    When the records outgrow the memory budget, sorted runs are spilled to temporary
+    files and merged back as a stream
+    """
+    def __init__(self, child: Operator, order_by: List[Tuple[str, bool]], memory_budget: Optional[int] = None) -> None:
+        self.child = child
+        self.order_by = order_by # (column, is_desc)
+        self.memory_budget = memory_budget # None keeps everything in memory
+        self.spilled_runs = 0
+        
+    def _sort(self, records: List[Dict[str, Any]]) -> None:
+        # Sorts are stable, so sorting by the last key first gives the right multi-column order
+        for column, is_desc in reversed(self.order_by):
+            records.sort(key=lambda record: (record.get(column) is not None, record.get(column)), reverse=is_desc)
+            
+    def _spill(self, records: List[Dict[str, Any]]) -> IO[bytes]:
+        """Write a sorted run as the column names followed by chunks of value tuples"""
+        self._sort(records)
+        run = tempfile.TemporaryFile()
+        pickle.dump(list(records[0]), run, protocol=pickle.HIGHEST_PROTOCOL)
+        for start in range(0, len(records), SPILL_CHUNK_SIZE):
+            chunk = [tuple(record.values()) for record in records[start:start + SPILL_CHUNK_SIZE]]
+            pickle.dump(chunk, run, protocol=pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self.spilled_runs += 1
+        return run
+    
+    def _read_run(self, run: IO[bytes]) -> Iterator[Dict[str, Any]]:
+        names = pickle.load(run)
+        while True:
+            try:
+                chunk = pickle.load(run)
+            except EOFError:
+                return
+            for values in chunk:
+                yield dict(zip(names, values))
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        runs: List[IO[bytes]] = []
+        records: List[Dict[str, Any]] = []
+        buffered_bytes = 0
+        record_size = 0
+        
+        try:
+            for position, record in enumerate(self.child):
+                records.append(record)
+                if self.memory_budget is None:
+                    continue
+                
+                # Measuring every record is expensive, so the size is sampled
+                if position % 64 == 0:
+                    record_size = estimate_record_size(record)
+                buffered_bytes += record_size
+                if buffered_bytes >= self.memory_budget:
+                    runs.append(self._spill(records))
+                    records = []
+                    buffered_bytes = 0
+                    
+            self._sort(records)
+            if not runs:
+                yield from records
+                return
+            
+            # The records still in memory are the newest, so they go last to keep the sort stable
+            key, reverse = order_by_key(self.order_by)
+            sorted_runs = [self._read_run(run) for run in runs] + [iter(records)]
+            yield from heapq.merge(*sorted_runs, key=key, reverse=reverse)
+        finally:
+            for run in runs:
+                run.close()
+            
+    def describe(self) -> str:
+        description = f"Sort by {format_order_by(self.order_by)}"
+        if self.spilled_runs:
+            description += f" spilled runs: {self.spilled_runs}"
+        return description
+
+class TopK(Operator):
+    """
+    ORDER BY ... LIMIT without sorting every record: a heap keeps the first k records seen so far,
+    which takes O(n log k) time and O(k) memory. Equal records keep their input order, like Sort
+    """
+    def __init__(self, child: Operator, order_by: List[Tuple[str, bool]], k: int) -> None:
+        self.child = child
+        self.order_by = order_by # (column, is_desc)
+        self.k = k
+        
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        key, reverse = order_by_key(self.order_by)
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        yield from select(self.k, self.child, key=key)
+        
+    def describe(self) -> str:
+        return f"TopK {self.k} by {format_order_by(self.order_by)}"
+
+class Project(Operator):
+    """Keeps the selected columns, renaming them to their aliases"""
+    def __init__(self, child: Operator, columns: Optional[List[Tuple[str, str]]]) -> None:
+        self.child = child
+        self.columns = columns # (source, output name), None keeps every column
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        if self.columns is None:
+            yield from self.child
+            return
+        
+        for record in self.child:
+            yield {name: record.get(source) for source, name in self.columns}
+            
+    def describe(self) -> str:
+        if self.columns is None:
+            return "Project *"
+        return "Project " + ", ".join(source if source == name else f"{source} AS {name}" for source, name in self.columns)
+
+class Distinct(Operator):
+    """Drops records that were already produced"""
+    def __init__(self, child: Operator) -> None:
+        self.child = child
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        seen = set()
+        for record in self.child:
+            key = tuple(record.items())
+            if key not in seen:
+                seen.add(key)
+                yield record
+
+class Limit(Operator):
+    """Skips OFFSET records and stops after LIMIT records"""
+    def __init__(self, child: Operator, limit: Optional[int], offset: Optional[int]) -> None:
+        self.child = child
+        self.limit = limit
+        self.offset = offset
+    
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        start = self.offset or 0
+        stop = start + self.limit if self.limit else None
+        yield from islice(self.child, start, stop)
+        
+    def describe(self) -> str:
+        return f"Limit {self.limit} offset {self.offset or 0}"
+
+class AnalyzedOperator(Operator):
+    """Wraps a step of the plan to count the records it produces and the time spent producing them, its children included"""
+    def __init__(self, operator: Operator) -> None:
+        self.operator = operator
+        self.estimated_rows = operator.estimated_rows
+        self.actual_rows = 0
+        self.seconds = 0.0
+        
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        records = iter(self.operator)
+        while True:
+            start = time.perf_counter()
+            record = next(records, None)
+            self.seconds += time.perf_counter() - start
+            if record is None:
+                return
+            self.actual_rows += 1
+            yield record
+            
+    def children(self) -> List[Operator]:
+        return self.operator.children()
+    
+    def describe(self) -> str:
+        return self.operator.describe()
+    
+def analyze_plan(plan: Operator) -> AnalyzedOperator:
+    """Wrap every step of a plan in an AnalyzedOperator"""
+    children = plan.children()
+    for name, value in list(vars(plan).items()):
+        if any(value is child for child in children):
+            setattr(plan, name, analyze_plan(value))
+    return AnalyzedOperator(plan)
+
+def format_plan(plan: Operator, depth: int = 0) -> str:
+    """The plan as an indented tree, one step per line with its estimated (and once analyzed, actual) rows"""
+    details = []
+    if plan.estimated_rows is not None:
+        details.append(f"estimated rows={plan.estimated_rows:.0f}")
+    if isinstance(plan, AnalyzedOperator):
+        details.append(f"actual rows={plan.actual_rows}")
+        details.append(f"time={plan.seconds * 1000:.3f} ms")
+        
+    prefix = "  " * depth + ("-> " if depth else "")
+    lines = [f"{prefix}{plan.describe()} ({', '.join(details)})"]
+    lines.extend(format_plan(child, depth + 1) for child in plan.children())
+    return "\n".join(lines)
+
+class MaterializedView:
+    """
+    Groups of a GROUP BY query with their running SUM, AVG and COUNT, updated by the table on
+    every insert and delete. Values are added to and subtracted from the totals, so MIN and MAX
+    (which can't be undone) aren't supported
+    """
+    functions = ("SUM", "AVG", "COUNT")
+    
+    def __init__(self, query: 'QueryBuilder') -> None:
+        # The groups are kept for one WHERE clause, a placeholder would change it on every execution
+        parameters = query.parameters()
+        if parameters:
+            raise ValueError(f"A materialized view can't use placeholders, got: {', '.join(parameters)}")
+        
+        executor = QueryExecutor(query)
+        self.query = query
+        self.group_by = list(query._group_by)
+        self.aggregates = [(function, column) for function, column, _ in executor._aggregates()]
+        self.conditions = executor._conditions()
+        
+        if query._joins:
+            raise ValueError("A materialized view can't use JOIN")
+        if not self.group_by:
+            raise ValueError("A materialized view needs GROUP BY")
+        if not self.aggregates or any(function not in self.functions for function, _ in self.aggregates):
+            raise ValueError(f"A materialized view needs aggregates and only supports {', '.join(self.functions)}")
+        selected = set() if query._selected_columns == "*" else set(query._transform_column_selector_union_to_str(tuple(query._selected_columns)))
+        if query._selected_columns == "*" or not selected <= set(self.group_by):
+            raise ValueError("A materialized view can only select its GROUP BY columns")
+        
+        self.column_names = set(self.group_by) | {column for _, column in self.aggregates if column != "*"} | {field for field, _, _ in self.conditions}
+        self._data_types = {name: query.table.column_repository.data_type(name) for name in self.column_names}
+        self._matches = compile_predicate(self.conditions)
+        self._key = (frozenset(self.group_by), query._where_key())
+        # Group key -> [group record, rows, totals per aggregate, non NULL values per aggregate]
+        self._groups: Dict[Any, List[Any]] = {}
+        
+    def _record(self, row: Row) -> Dict[str, Any]:
+        return {name: convert_value(row.get(name), data_type) for name, data_type in self._data_types.items()}
+    
+    def _group_key(self, record: Dict[str, Any]) -> Any:
+        return tuple(record.get(column) for column in self.group_by)
+    
+    def insert_row(self, row: Row) -> None:
+        self._update(row, 1)
+        
+    def delete_row(self, row: Row) -> None:
+        self._update(row, -1)
+        
+    def _update(self, row: Row, sign: int) -> None:
+        record = self._record(row)
+        if not self._matches(record):
+            return
+        
+        key = self._group_key(record)
+        group = self._groups.get(key)
+        if group is None:
+            group_record = {column: record.get(column) for column in self.group_by}
+            group = self._groups[key] = [group_record, 0, [0] * len(self.aggregates), [0] * len(self.aggregates)]
+            
+        group[1] += sign
+        totals, counts = group[2], group[3]
+        for position, (function, column) in enumerate(self.aggregates):
+            value = True if column == "*" else record.get(column)
+            if value is None:
+                continue
+            counts[position] += sign
+            if function != "COUNT":
+                totals[position] += sign * value
+                
+        if group[1] == 0:
+            del self._groups[key]
+            
+    def answers(self, query: 'QueryBuilder', aggregates: List[Tuple[str, str, str]]) -> bool:
+        """Whether the groups of the query are the groups of this view, with aggregates it keeps"""
+        if query.table is not self.query.table or query._joins or query._selected_columns == "*":
+            return False
+        selected = set(query._transform_column_selector_union_to_str(tuple(query._selected_columns)))
+        return (
+            (frozenset(query._group_by), query._where_key()) == self._key
+            and selected <= set(self.group_by)
+            and all((function, column) in self.aggregates for function, column, _ in aggregates)
+        )
+    
+    def records(self, aggregates: List[Tuple[str, str, str]]) -> Iterator[Dict[str, Any]]:
+        """One record per group with the requested (function, column, output name) aggregates"""
+        positions = [self.aggregates.index((function, column)) for function, column, _ in aggregates]
+        for group_record, _, totals, counts in self._groups.values():
+            record = dict(group_record)
+            for (function, _, name), position in zip(aggregates, positions):
+                if function == "COUNT":
+                    record[name] = counts[position]
+                elif not counts[position]:
+                    record[name] = None
+                else:
+                    record[name] = totals[position] / counts[position] if function == "AVG" else totals[position]
+            yield record
+            
+    def __len__(self) -> int:
+        return len(self._groups)
+    
+class MaterializedViewScan(Operator):
+    """Reads the groups of a materialized view instead of scanning and aggregating the table"""
+    def __init__(self, view: MaterializedView, aggregates: List[Tuple[str, str, str]]) -> None:
+        self.view = view
+        self.aggregates = aggregates
+        
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        yield from self.view.records(self.aggregates)
+        
+    def describe(self) -> str:
+        return f"MaterializedViewScan on {self.view.query.table.table_name} group by: {', '.join(self.view.group_by) or '()'}"
+    
+DEFAULT_CACHE_BUDGET = 64 * 1024 * 1024 # Bytes of results a QueryCache keeps
+
+class QueryCache:
+    """
+    Results of recent queries, keyed by QueryBuilder.fingerprint(). An entry is only used while
+    the version of every table it read is unchanged, so adding or removing a row or changing the
+    schema of a table invalidates exactly the queries on that table. The least recently used
+    entries are evicted once the results go over max_bytes
+    """
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BUDGET) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        # Fingerprint -> (table versions, records, bytes), least recently used first
+        self._entries: 'OrderedDict[Tuple[Any, ...], Tuple[Tuple[Any, ...], List[Dict[str, Any]], int]]' = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def get(self, key: Tuple[Any, ...], versions: Tuple[Any, ...]) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != versions:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        
+    def put(self, key: Tuple[Any, ...], versions: Tuple[Any, ...], records: List[Dict[str, Any]]) -> None:
+        size = sum(estimate_record_size(record) for record in records)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (versions, records, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                
+    def _remove(self, key: Tuple[Any, ...]) -> None:
+        self._bytes -= self._entries.pop(key)[2]
+        
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+    
+class PreparedQuery:
+    """
+    A query rendered and planned once, executed again with different values for its Param placeholders.
+    The plan is rebuilt only when the schema, indexes, materialized views or statistics of a queried table change,
+    or when more than STATISTICS_REFRESH_RATIO of its rows changed since it was planned
+    """
+    def __init__(self, query: QueryBuilder) -> None:
+        # A snapshot, so that later calls on the builder don't change the prepared query
+        self.query = copy.copy(query)
+        for name, value in vars(query).items():
+            if isinstance(value, (list, dict)):
+                setattr(self.query, name, value.copy())
+        self.sql = str(self.query)
+        self.parameters = self.query.parameters()
+        self._plan: Optional[Operator] = None
+        self._plan_key: Optional[Tuple[Any, ...]] = None
+        self._planned_rows: List[Tuple[int, int]] = [] # (modifications, rows) of every queried table when planned
+        self._lock = threading.Lock()
+        
+    def _current_plan_key(self) -> Tuple[Any, ...]:
+        tables = tuple(
+            (
+                table.column_repository.version,
+                tuple(map(id, table.indexes)),
+                tuple(map(id, table.materialized_views)),
+                table.statistics_version
+            )
+            for table in self.query._tables()
+        )
+        # Grouping on dictionary codes relies on the column still being dictionary encoded
+        dictionaries = tuple(id(self.query.table.row_repository.dictionary(column)) for column in self.query._group_by)
+        return tables, dictionaries
+    
+    def _rows_changed(self) -> bool:
+        """Whether a queried table changed enough since planning for its statistics to be recomputed"""
+        return any(
+            table._modifications - modifications > STATISTICS_REFRESH_RATIO * max(rows, 1)
+            for table, (modifications, rows) in zip(self.query._tables(), self._planned_rows)
+        )
+        
+    def plan(self) -> Operator:
+        """The plan with placeholders, built on first use"""
+        key = self._current_plan_key()
+        with self._lock:
+            if self._plan is None or self._plan_key != key or self._rows_changed():
+                self._planned_rows = [(table._modifications, len(table.row_repository)) for table in self.query._tables()]
+                self._plan = QueryExecutor(self.query).build_plan()
+                # Planning may have refreshed statistics
+                self._plan_key = self._current_plan_key()
+            return self._plan
         
-        return self
-    
-    def avg(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+    def execute(self, **parameters: Any) -> Cursor:
         """
-        Add AVG aggregate function
-        Example: avg("salary", { "column": "bonus", "alias": "average_bonus" })
-        Results: AVG(salary), AVG(bonus) AS average_bonus
+        Run the prepared plan with a value for every placeholder
+        Example: execute(min_price=100)
         """
-        if args:
-            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
-            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+        missing = [name for name in self.parameters if name not in parameters]
+        if missing:
+            raise ValueError(f"Missing values for parameters: {', '.join(missing)}")
+        unknown = [name for name in parameters if name not in self.parameters]
+        if unknown:
+            raise ValueError(f"Unknown parameters: {', '.join(unknown)}")
+        return Cursor(iter(self.plan().bind(parameters)))
+    
+    def __str__(self) -> str:
+        return self.sql
+
+INDEX_ROW_COST = 4.0 # Cost of fetching one row through an index, compared to reading one during a full scan
+
+class QueryExecutor:
+    """Turns the state of a QueryBuilder into a chain of operators and runs it in memory"""
+    def __init__(self, query: QueryBuilder) -> None:
+        self.query = query
+        self.scans: List[TableScan] = [] # Full scans of the plan, which report the blocks they skipped
+    
+    def _aggregates(self) -> List[Tuple[str, str, str]]:
+        aggregates: List[Tuple[str, str, str]] = []
+        for function, selectors in self.query._aggregate_selectors():
+            for selector in selectors:
+                if isinstance(selector, str):
+                    aggregates.append((function, selector, f"{function}({selector})"))
+                else:
+                    aggregates.append((function, selector.column, selector.alias or f"{function}({selector.column})"))
+        return aggregates
+    
+    def _output_columns(self, aggregates: List[Tuple[str, str, str]]) -> Optional[List[Tuple[str, str]]]:
+        columns: List[Tuple[str, str]] = []
+        
+        if self.query._selected_columns == "*" and aggregates:
+            # Like the SQL output: only the grouped columns have one value per group
+            columns.extend((name, name) for name in self.query._group_by)
+            columns.extend((name, name) for _, _, name in aggregates)
+            return columns
+        
+        if self.query._selected_columns == "*":
+            if not self.query._joins:
+                return None
             
-            if is_input_valid:
-                self._avg.extend(list(args))
+            # With joins every column is named after its table, so equal names don't hide each other
+            for table in [self.query.table] + [join.table for join in self.query._joins]:
+                names = [column.name for column in table.column_repository.columns]
+                names += [key.name for key in table.column_repository.foreign_keys]
+                columns.extend((f"{table.table_name}.{name}", f"{table.table_name}.{name}") for name in names)
+            return columns
+        
+        for selector in self.query._selected_columns:
+            if isinstance(selector, str):
+                columns.append((selector, selector))
             else:
-                print("Cannot AVG properties that don't exist")
+                columns.append((selector.column, selector.alias or selector.column))
+        columns.extend((name, name) for _, _, name in aggregates)
+        return columns
+    
+    def _order_by(self) -> List[Tuple[str, bool]]:
+        return [
+            (selector, False) if isinstance(selector, str) else (selector.column, selector.is_desc)
+            for selector in self.query._order_by
+        ]
+    
+    def _column(self, field: str) -> Optional[Column]:
+        """The column a WHERE field names: of the queried table, else of the first joined table that has it, or table.column of a joined table"""
+        tables = self.query._tables()
+        columns = (table.column_repository.column(field) for table in tables)
+        column = next((column for column in columns if column is not None), None)
+        if column is None and "." in field:
+            table_name, name = field.split(".", 1)
+            column = next((table.column_repository.column(name) for table in tables[1:] if table.table_name == table_name), None)
+        return column
+    
+    def _conditions(self) -> List[Tuple[str, str, Any]]:
+        """WHERE conditions with the expected values converted once, so they compare with the converted records"""
+        conditions: List[Tuple[str, str, Any]] = []
         
-        return self
+        for field, details in self.query._where_conditions.items():
+            value = details["value"]
+            column = self._column(field)
+            if column is not None and details["operator"] != "LIKE":
+                try:
+                    if isinstance(value, Param):
+                        value = replace(value, data_type=column.data_type) # Converted when it is bound
+                    elif isinstance(value, (list, tuple)):
+                        value = [convert_value(item, column.data_type) for item in value]
+                    else:
+                        value = convert_value(value, column.data_type)
+                except ValueError:
+                    pass
+            conditions.append((field, details["operator"], value))
+        return conditions
     
-    def sum(self, *args: Union[str, ColumnSelector]) -> 'QueryBuilder':
+    def _statistics(self, field: str) -> Optional[ColumnStatistics]:
+        """Statistics of a WHERE or GROUP BY field: a column of the queried table or of a joined table, or table.column"""
+        tables = [self.query.table] + [join.table for join in self.query._joins]
+        name = field
+        if "." in field:
+            table_name, name = field.split(".", 1)
+            tables = [table for table in tables if table.table_name == table_name]
+            
+        for table in tables:
+            statistics = table.column_statistics(name)
+            if statistics is not None:
+                return statistics
+        return None
+    
+    def _selectivity(self, conditions: List[Tuple[str, str, Any]]) -> float:
+        """Estimated fraction of the rows matching every condition, taking them as independent"""
+        selectivity = 1.0
+        for field, operator, value in conditions:
+            statistics = self._statistics(field)
+            # The value of a placeholder isn't known while planning
+            selectivity *= statistics.selectivity(operator, value) if statistics and not isinstance(value, Param) else DEFAULT_SELECTIVITY
+        return selectivity
+    
+    def _access_path(self, conditions: List[Tuple[str, str, Any]], aggregates: List[Tuple[str, str, str]]) -> Tuple[Operator, List[Tuple[str, str, Any]], bool]:
         """
-        Add SUM aggregate function
-        Example: sum("salary", { "column": "bonus", "alias": "total_bonus" }))
-        Results: SUM(salary), SUM(bonus) as total_bonus
+        Pick the cheapest way to read the rows: a full scan, a lookup of one condition on an index
+        or, for ORDER BY ... LIMIT, reading a sorted index in order until enough rows matched.
+        Returns the scan, the conditions it doesn't answer and whether it is already sorted.
         """
-        if args:
-            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
-            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
-            
-            if is_input_valid:
-                self._sum.extend(list(args))
-            else:
-                print("Cannot SUM properties that don't exist")
+        table = self.query.table
+        row_count = len(table.row_repository)
         
-        return self
+        # (cost, scan, remaining conditions, is sorted), costs count rows read
+        full_scan = TableScan(table)
+        full_scan.estimated_rows = row_count * self._selectivity(conditions)
+        candidates: List[Tuple[float, Operator, List[Tuple[str, str, Any]], bool]] = [(row_count, full_scan, conditions, False)]
         
-    def distinct(self, is_distinct: bool) -> 'QueryBuilder':
+        for position, (field, operator, value) in enumerate(conditions):
+            index = table.find_index(field, operator)
+            if index is not None:
+                scan = IndexScan(table, index, operator, value)
+                scan.estimated_rows = row_count * self._selectivity([conditions[position]])
+                remaining = conditions[:position] + conditions[position + 1:]
+                candidates.append((scan.estimated_rows * INDEX_ROW_COST, scan, remaining, False))
+                
+        order_by = self._order_by()
+        if len(order_by) == 1 and self.query._limit_value and not self.query._group_by and not aggregates and not self.query._joins:
+            column, is_desc = order_by[0]
+            index = table.find_index(column, kind=SortedIndex.kind)
+            if isinstance(index, SortedIndex):
+                # Rows are read in order until LIMIT + OFFSET of them match the conditions
+                wanted = self.query._limit_value + (self.query._offset_value or 0)
+                scan = IndexOrderScan(table, index, is_desc)
+                scan.estimated_rows = min(row_count, wanted / max(self._selectivity(conditions), 1 / max(row_count, 1)))
+                candidates.append((scan.estimated_rows * INDEX_ROW_COST, scan, conditions, True))
+                
+        _, scan, remaining, is_sorted = min(candidates, key=itemgetter(0))
+        return scan, remaining, is_sorted
+    
+    def _referenced_columns(self, aggregates: List[Tuple[str, str, str]]) -> Optional[Set[str]]:
+        """Every column the query reads, None when it selects all of them"""
+        if self.query._selected_columns == "*" or self.query._joins:
+            return None
+        
+        names = set(self.query._transform_column_selector_union_to_str(tuple(self.query._selected_columns)))
+        names.update(self.query._where_conditions)
+        names.update(self.query._group_by)
+        names.update(column for _, column, _ in aggregates)
+        names.update(column for column, _ in self._order_by())
+        return names
+    
+    def _join(self, plan: Operator, conditions: List[Tuple[str, str, Any]]) -> Tuple[Operator, List[Tuple[str, str, Any]]]:
         """
-        Add DISTINCT to a SELECT
-        Example: distinct(True)
-        Results: SELECT DISTINCT ...
+        Add a hash join per JOIN clause. Conditions on columns of the first table are
+        applied before joining, the others are returned to be applied after
         """
-        self._is_distinct = is_distinct        
-
-        return self
+        table = self.query.table
+        base_conditions = [condition for condition in conditions if condition[0] in table.column_repository]
+        if isinstance(plan, TableScan):
+            plan.conditions = base_conditions
+            plan.estimated_rows = len(table.row_repository) * self._selectivity(base_conditions)
+        elif base_conditions:
+            plan = self._filter(plan, base_conditions)
+            
+        for position, join in enumerate(self.query._joins):
+            left_key = join.left_column
+            if join.left_table is not table:
+                left_key = f"{join.left_table.table_name}.{join.left_column}"
+                
+            right_scan = TableScan(join.table)
+            right_scan.estimated_rows = right_rows = len(join.table.row_repository)
+            left_rows = plan.estimated_rows or 0
+            # Every left record matches the right rows sharing its key
+            right_key_statistics = join.table.column_statistics(join.right_column)
+            matches_per_key = right_rows / max(right_key_statistics.distinct_count if right_key_statistics else 1, 1)
+            plan = HashJoin(
+                plan,
+                right_scan,
+                left_key,
+                join.right_column,
+                join.table.table_name,
+                left_table_name=table.table_name if position == 0 else None,
+                build_left=left_rows < right_rows
+            )
+            plan.estimated_rows = left_rows * matches_per_key
+            
+        return plan, [condition for condition in conditions if condition[0] not in table.column_repository]
     
-    def where(self, **kwargs: Any) -> 'QueryBuilder':
+    def _filter(self, plan: Operator, conditions: List[Tuple[str, str, Any]]) -> Operator:
+        filtered = Filter(plan, conditions)
+        filtered.estimated_rows = (plan.estimated_rows or 0) * self._selectivity(conditions)
+        return filtered
+    
+    def _groups(self, input_rows: float) -> float:
+        """Estimated number of GROUP BY groups among input_rows records"""
+        if not self.query._group_by:
+            return 1
+        groups = 1.0
+        for column in self.query._group_by:
+            statistics = self._statistics(column)
+            groups *= statistics.distinct_count if statistics else input_rows
+        return min(groups, input_rows)
+    
+    def _aggregate_options(self, scan: Operator) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.query._sample_rate,
+            "confidence": self.query._confidence,
+            "rows_sampled": isinstance(scan, TableScan) and scan.sample_rate < 1
+        }
+    
+    def _group_dictionaries(self, aggregates: List[Tuple[str, str, str]]) -> Dict[str, List[str]]:
+        """Dictionaries of the dictionary encoded GROUP BY columns, which are grouped on their codes"""
+        aggregated = {column for _, column, _ in aggregates}
+        dictionaries: Dict[str, List[str]] = {}
+        for column in self.query._group_by:
+            dictionary = self.query.table.row_repository.dictionary(column)
+            if dictionary is not None and column not in aggregated:
+                dictionaries[column] = dictionary
+        return dictionaries
+    
+    def _parallel(
+        self,
+        scan: TableScan,
+        aggregates: List[Tuple[str, str, str]],
+        dictionaries: Dict[str, List[str]]
+    ) -> Operator:
         """
-        Add WHERE clause
-        Example: where(name="John", age__gt=25)
-        Results: WHERE name = "John" AND age > 25
+        Run the scan in worker processes: each one aggregates its partition into accumulator states
+        that are merged here, or keeps only its first rows for ORDER BY ... LIMIT
         """
-        all_keys = [key for key, value in kwargs.items()]
-        is_input_valid = self._validate_columns_existence(all_keys)
+        query = self.query
+        if query._group_by or aggregates:
+            group_by = query._group_by
+            options = self._aggregate_options(scan)
+            parallel_scan = ParallelScan(scan, lambda partition: HashAggregate(partition, group_by, aggregates, mode="partial", **options), query._workers)
+            parallel_scan.estimated_rows = scan.estimated_rows
+            plan: Operator = HashAggregate(parallel_scan, group_by, aggregates, mode="final", dictionaries=dictionaries, **options)
+            plan.estimated_rows = self._groups(scan.estimated_rows or 0)
+            return plan
         
-        if is_input_valid:
-            for key, value in kwargs.items():
-                # Handle special operators (e.g., age__gt=25)
-                if "__" in key:
-                    field, operator = key.split("__")
-                    if operator in operators:
-                        self._where_conditions[field] = {
-                            "operator": operators[operator],
-                            "value": value
-                        }
-                else:
-                    # Handle simple equality
-                    self._where_conditions[key] = {
-                        "operator": "=",
-                        "value": value
-                    }
+        if query._order_by and query._limit_value and not query._is_distinct:
+            order_by = self._order_by()
+            k = query._limit_value + (query._offset_value or 0)
+            plan = ParallelScan(scan, lambda partition: TopK(partition, order_by, k), query._workers)
         else:
-            print("Make sure you pass only existing fields to your WHERE clause")
+            plan = ParallelScan(scan, lambda partition: partition, query._workers)
+        plan.estimated_rows = scan.estimated_rows
+        return plan
+    
+    def build_plan(self) -> Operator:
+        query = self.query
+        aggregates = self._aggregates()
+        view = next((view for view in query.table.materialized_views if view.answers(query, aggregates)), None)
+        if view is not None:
+            plan: Operator = MaterializedViewScan(view, aggregates)
+            plan.estimated_rows = max(len(view), 1)
+            return self._finish(plan, aggregates, is_sorted=False)
+        
+        plan, conditions, is_sorted = self._access_path(self._conditions(), aggregates)
+        
+        dictionaries: Dict[str, List[str]] = {}
+        if isinstance(plan, TableScan):
+            self.scans.append(plan)
+            plan.column_names = self._referenced_columns(aggregates)
+            if not query._joins:
+                plan.conditions, conditions = conditions, []
+                dictionaries = self._group_dictionaries(aggregates)
+                plan.encoded_columns = set(dictionaries)
+                # A sample of the rows is enough when every aggregate is estimated from one
+                if aggregates and all(issubclass(accumulators[function], SampledAccumulator) for function, _, _ in aggregates):
+                    plan.sample_rate = query._sample_rate
+                    plan.estimated_rows = (plan.estimated_rows or 0) * query._sample_rate
+        scan = plan
+                
+        is_aggregated = bool(query._group_by or aggregates)
+        if isinstance(plan, TableScan) and query._workers > 1 and not query._joins:
+            plan, is_aggregated = self._parallel(plan, aggregates, dictionaries), False
             
-        return self
+        if query._joins:
+            plan, conditions = self._join(plan, conditions)
         
-    def order_by(self, *args: Union[str, OrderBySelector]) -> 'QueryBuilder':
-        """
-        Add ORDER BY clause
-        Example: order_by(name, { "column": "age", "is_desc": TRUE })
-        Results: ORDER BY name, age DESC
-        """
-        if args:
-            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
-            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
+        if conditions:
+            plan = self._filter(plan, conditions)
+        rows = plan.estimated_rows or 0
+        
+        if is_aggregated:
+            plan = HashAggregate(plan, query._group_by, aggregates, dictionaries=dictionaries, **self._aggregate_options(scan))
+            plan.estimated_rows = self._groups(rows)
             
-            if is_input_valid:
-                self._order_by.extend(list(args))
-            else:
-                print("Cannot ORDER BY properties that don't exist")
-                
-        return self
+        return self._finish(plan, aggregates, is_sorted)
     
-    def group_by(self, *args: str) -> 'QueryBuilder':
-        """
-        Add GROUP BY clause
-        Example: group_by("department")
-        Results: GROUP BY department
-        """
-        if args:
-            all_columns_and_fks_passed = self._transform_column_selector_union_to_str(args)
-            is_input_valid = self._validate_columns_existence(all_columns_and_fks_passed)
-            
-            if is_input_valid:
-                self._group_by.extend(list(args))
+    def _finish(self, plan: Operator, aggregates: List[Tuple[str, str, str]], is_sorted: bool) -> Operator:
+        """Add the steps after grouping: ORDER BY, the selected columns, DISTINCT and LIMIT"""
+        query = self.query
+        rows = plan.estimated_rows or 0
+        if query._order_by and not is_sorted:
+            if query._limit_value and not query._is_distinct:
+                plan = TopK(plan, self._order_by(), query._limit_value + (query._offset_value or 0))
+                rows = min(rows, plan.k)
             else:
-                print("Cannot GROUP BY properties that don't exist")
-                
-        return self
+                plan = Sort(plan, self._order_by(), query._memory_budget)
+            plan.estimated_rows = rows
+        
+        plan = Project(plan, self._output_columns(aggregates))
+        plan.estimated_rows = rows
+        
+        if query._is_distinct:
+            plan = Distinct(plan)
+            plan.estimated_rows = rows
+        
+        # Same rules as the SQL output: LIMIT 0 and OFFSET 0 are left out
+        if query._limit_value or query._offset_value:
+            plan = Limit(plan, query._limit_value, query._offset_value)
+            rows = max(rows - (query._offset_value or 0), 0)
+            plan.estimated_rows = min(rows, query._limit_value) if query._limit_value else rows
+        
+        return plan
     
-    def limit(self, value: int) -> 'QueryBuilder':
+    def execute(self) -> Iterator[Dict[str, Any]]:
+        return iter(self.build_plan())
+
+def sqlite_value(value: Any) -> Any:
+    """A value as SQLite stores it, which has no DATETIME type"""
+    return value.isoformat(" ") if isinstance(value, datetime) else value
+
+class SQLiteEngine:
+    """
+    Runs queries in a SQLite database file instead of in memory, for tables that outgrow it and to
+    compare both engines. Tables are copied in with load, then queries run with their values bound
+    as parameters and their results streamed from the cursor
+    Example: engine = SQLiteEngine("analytics.db").load(users).load(orders) then engine.execute(qb)
+    """
+    unsupported_aggregates = ("APPROX_COUNT_DISTINCT", "APPROX_AVG", "APPROX_SUM")
+    
+    def __init__(self, path: str = ":memory:") -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        
+    def _create_table(self, table: Table) -> str:
         """
-        Add LIMIT clause
-        Example: limit(5)
-        Results: LIMIT 5
+        The CREATE TABLE statement of the table adapted to SQLite: foreign key columns are declared too,
+        and AUTO_INCREMENT is left out since SQLite has no such keyword
         """
-        self._limit_value = value
+        foreign_keys = table.column_repository.foreign_keys
+        parts = [table._format_column(column).replace(" AUTO_INCREMENT", "") for column in table.column_repository.columns]
+        parts.extend(f"{key.name} {key.data_type.value}" if key.data_type else key.name for key in foreign_keys)
+        parts.extend(table._format_foreign_key(key) for key in foreign_keys)
+        return f"CREATE TABLE {table.table_name} (\n    " + ",\n    ".join(parts) + "\n)"
+        
+    def load(self, table: Table, batch_size: int = 10000) -> 'SQLiteEngine':
+        """(Re)create the table and its indexes, and copy its rows in one transaction"""
+        columns = table.column_repository.columns
+        foreign_keys = table.column_repository.foreign_keys
+        names = [column.name for column in columns] + [key.name for key in foreign_keys]
+        insert = f"INSERT INTO {table.table_name} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+        records = table.row_repository.records(columns, foreign_keys)
+        
+        with self.connection:
+            self.connection.execute(f"DROP TABLE IF EXISTS {table.table_name}")
+            self.connection.execute(self._create_table(table))
+            while batch := [tuple(sqlite_value(record[name]) for name in names) for record in islice(records, batch_size)]:
+                self.connection.executemany(insert, batch)
+            for column_name in {index.column_name for index in table.indexes}:
+                self.connection.execute(f"CREATE INDEX {table.table_name}_{column_name} ON {table.table_name} ({column_name})")
         return self
     
-    def offset(self, value: int) -> 'QueryBuilder':
+    def execute(self, query: QueryBuilder, **parameters: Any) -> Cursor:
         """
-        Add OFFSET clause
-        Example: offset(10)
-        Results OFFSET 10
+        Run the SQL of a query with its WHERE values (and the values of its Param placeholders) bound.
+        Records are read from the SQLite cursor as they are fetched
+        Example: execute(QueryBuilder(orders).select("user_id").sum("total").where(user_id=Param("user")).group_by("user_id"), user=1)
         """
-        self._offset_value = value
-        return self
-    
-    def _format_value(self, value: Any) -> str:
-        """Format values based on their type"""
-        if isinstance(value, str):
-            return f"'{value}'"
-        elif isinstance(value, datetime):
-            return f"'{value.strftime("%Y-%m-%d %H:%M:%S")}'"
-        elif isinstance(value, (list, tuple)):
-            return f"({", ".join(map(self._format_value, value))})"
-        return str(value)
-    
-    def __str__(self) -> str:
-        """Convert the query to SQL string"""
-        distinct = "DISTINCT " if self._is_distinct else ""
+        used = [function for function, selectors in query._aggregate_selectors() if selectors and function in self.unsupported_aggregates]
+        if used:
+            raise ValueError(f"SQLite can't compute {', '.join(used)}")
+        missing = [name for name in query.parameters() if name not in parameters]
+        if missing:
+            raise ValueError(f"Missing values for parameters: {', '.join(missing)}")
         
-        if self._selected_columns == "*":
-            sql = f"SELECT {distinct}*"
-        else:
-            select_conditions: List[str] = []
-            
-            for condition in self._selected_columns:
-                if isinstance(condition, str):
-                    select_conditions.append(condition)
-                else:
-                    if condition.alias:
-                        select_conditions.append(f"{condition.column} AS {condition.alias}")
-                    else:
-                        select_conditions.append(condition.column)
-                        
-            for condition in self._avg:
-                if isinstance(condition, str):
-                    select_conditions.append(f"AVG({condition})")
-                else:
-                    if condition.alias:
-                        select_conditions.append(f"AVG({condition.column}) AS {condition.alias}")
-                    else:
-                        select_conditions.append(f"AVG({condition.column})")
-                        
-            for condition in self._sum:
-                if isinstance(condition, str):
-                    select_conditions.append(f"SUM({condition})")
-                else:
-                    if condition.alias:
-                        select_conditions.append(f"SUM({condition.column}) AS {condition.alias}")
-                    else:
-                        select_conditions.append(f"SUM({condition.column})")
-            
-            sql = f"SELECT {distinct}{", ".join(select_conditions)}"
-            
-        sql += f"\nFROM {self.table.table_name}"
+        bound: Dict[str, Any] = {}
+        def placeholder(value: Any) -> str:
+            if isinstance(value, Param):
+                value = parameters[value.name]
+            if isinstance(value, (list, tuple, set, frozenset)):
+                return f"({', '.join(placeholder(item) for item in value)})"
+            name = f"p{len(bound)}"
+            bound[name] = sqlite_value(value)
+            return f":{name}"
         
-        if self._where_conditions:
-            where_conditions: List[str] = []
-             
-            for field, details in self._where_conditions.items():
-                operator = details["operator"]
-                value = self._format_value(details["value"])
-                where_conditions.append(f"{field} {operator} {value}")
-                
-            sql += "\nWHERE " + " AND ".join(where_conditions)
-            
-        if self._group_by:
-            sql +="\nGROUP BY " + ", ".join(self._group_by)
-            
-        if self._order_by:
-            order_by_conditions: List[str] = []
-            
-            for condition in self._order_by: # type: ignore
-                if isinstance(condition, str):
-                    order_by_conditions.append(condition)
-                elif isinstance(condition, OrderBySelector):
-                    if condition.is_desc:
-                        order_by_conditions.append(f"{condition.column} DESC")
-                    else:
-                        order_by_conditions.append(condition.column)
-            
-            sql += "\nORDER BY " + ", ".join(order_by_conditions)
-            
-        if self._limit_value:
-            sql += f"\nLIMIT {self._limit_value}"
-            
-        if self._offset_value:
-            sql += f"\nOFFSET {self._offset_value}"
+        cursor = self.connection.execute(query.to_sql(placeholder), bound)
+        return Cursor(self._records(cursor, self._output_types(query)))
+    
+    def _output_types(self, query: QueryBuilder) -> Dict[str, SQLDataType]:
+        """Types of the selected columns by output name. SQLite stores e.g. a DECIMAL 1000.0 as the integer 1000"""
+        column_types: Dict[str, SQLDataType] = {}
+        for table in reversed(query._tables()):
+            column_types.update((column.name, column.data_type) for column in table.column_repository.columns)
+            column_types.update((key.name, key.data_type) for key in table.column_repository.foreign_keys if key.data_type)
+        if query._selected_columns == "*":
+            return column_types
+        
+        output_types: Dict[str, SQLDataType] = {}
+        for selector in query._selected_columns:
+            column, name = (selector, selector) if isinstance(selector, str) else (selector.column, selector.alias or selector.column)
+            if column in column_types:
+                output_types[name] = column_types[column]
+        return output_types
+    
+    def _records(self, cursor: sqlite3.Cursor, output_types: Dict[str, SQLDataType]) -> Iterator[Dict[str, Any]]:
+        names = [description[0] for description in cursor.description]
+        converted = [(position, output_types[name]) for position, name in enumerate(names) if output_types.get(name) in converters]
+        try:
+            for row in cursor:
+                if converted:
+                    row = list(row)
+                    for position, data_type in converted:
+                        row[position] = convert_value(row[position], data_type)
+                yield dict(zip(names, row))
+        finally:
+            try:
+                cursor.close()
+            except sqlite3.ProgrammingError:
+                pass # The engine was closed first, which closed the cursor too
             
-        return sql
+    def close(self) -> None:
+        self.connection.close()
 
 def test_query_builder():
     # Basic query
@@ -741,5 +4581,147 @@ def test_query_builder():
     print(qb)
     print("\n")
 
+    # Executing queries against the stored rows
+    qb = QueryBuilder(products)
+    qb.select("name", "price").where(price__gt=100)
+    print(list(qb.execute()))
+    print("\n")
+    
+    qb = QueryBuilder(orders)
+    qb.select("user_id").sum(ColumnSelector("total", "sum_total")).group_by("user_id").order_by(OrderBySelector("sum_total", True))
+    print(list(qb.execute()))
+    print("\n")
+    
+    # Query joining along a foreign key
+    qb = QueryBuilder(orders)
+    qb.select("total", "username").join(users)
+    print(qb)
+    print(list(qb.execute()))
+    print("\n")
+    
+    # Reading the results a batch at a time
+    cursor = QueryBuilder(orders).select("id", "total").execute()
+    print(cursor.fetchmany(1))
+    print(list(cursor.as_columns()))
+    print("\n")
+    
+    # Prepared query, rendered and planned once and executed with different values
+    prepared = QueryBuilder(products).select("name", "price").where(price__gt=Param("min_price")).prepare()
+    print(prepared)
+    print(list(prepared.execute(min_price=100)))
+    print(list(prepared.execute(min_price=10)))
+    print("\n")
+    
+    # The same query run by SQLite
+    engine = SQLiteEngine().load(users).load(orders)
+    qb = QueryBuilder(orders)
+    qb.select("user_id").sum(ColumnSelector("total", "sum_total")).where(total__gt=Param("min_total")).group_by("user_id")
+    print(list(engine.execute(qb, min_total=100)))
+    engine.close()
+    print("\n")
+    
+    # Plan of a query with estimated and actual rows per step
+    qb = QueryBuilder(orders)
+    qb.select("total", "username").join(users).where(total__gt=100)
+    qb.explain(analyze=True)
+    print("\n")
+    
+    # Saving a table and opening it again from its memory-mapped column files
+    with tempfile.TemporaryDirectory() as directory:
+        orders.save(directory)
+        saved_orders = Table.open(directory)
+        print(saved_orders)
+        print(list(QueryBuilder(saved_orders).select("user_id", "total").execute()))
+        
+        # Rows added after the save are in the write-ahead log until the next checkpoint
+        saved_orders.add_row({"user_id": 1, "total": "25.50"})
+        saved_orders.close()
+        reopened_orders = Table.open(directory)
+        print(list(QueryBuilder(reopened_orders).select("user_id", "total").execute()))
+        reopened_orders.close()
+        orders.close()
+    print("\n")
+    
+    # The row store and the columnar store give the same results
+    results: Dict[str, List[Any]] = {}
+    for storage in ("row", "columnar"):
+        events = create_table("events", storage)
+        events.add_column("id", SQLDataType.BIGINT, is_pk=True, auto_increment=True)
+        events.add_column("status", SQLDataType.TEXT, not_null=True)
+        events.add_column("amount", SQLDataType.INT)
+        events.create_index("status").create_index("amount", "sorted")
+        
+        # Threads inserting the first rows share one id sequence, so none of them is rejected
+        def insert_events() -> None:
+            for _ in range(50):
+                events.add_row({"status": "new", "amount": 0})
+        threads = [threading.Thread(target=insert_events) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        checks: List[Any] = [len(events.row_repository)]
+        
+        # Bulk load, an id too large for 64 bits and a duplicate id are reported as row errors
+        loaded = events.add_rows(
+            [{"status": ("new", "paid", "refunded")[n % 3], "amount": (n * 37) % 1000} for n in range(5000)]
+            + [{"id": "99999999999999999999", "status": "new"}, {"id": 1, "status": "new"}]
+        )
+        checks.append((loaded.inserted, [error.position for error in loaded.errors]))
+        
+        # Index lookups, top-K, compiled predicates, zone maps, a spilled sort and a parallel aggregate
+        checks.append(len(QueryBuilder(events).select("id").where(status="paid").execute().fetchall()))
+        checks.append(QueryBuilder(events).select("id", "amount").where(amount__lt=10).order_by("amount", "id").limit(5).execute().fetchall())
+        checks.append(QueryBuilder(events).select("id").where(status__like="re%", amount__in=[1, 2, 3]).execute().fetchall())
+        checks.append(QueryBuilder(events).select("id").where(amount__gte=998).execute().fetchall())
+        checks.append(QueryBuilder(events).select("id", "amount").order_by(OrderBySelector("amount", True), "id").memory_budget(20000).execute().fetchmany(3))
+        grouped = QueryBuilder(events).select("status").count("*").sum(ColumnSelector("amount", "total")).group_by("status")
+        checks.append(grouped.execute().fetchall())
+        checks.append(grouped.parallel(2).execute().fetchall())
+        checks.append(QueryBuilder(events).select("status").approx_count_distinct("amount").group_by("status").execute().fetchall())
+        
+        # Cached results and a materialized view stay in step with new rows
+        result_cache = QueryCache()
+        cached = QueryBuilder(events).select("status").count("*").group_by("status").cache(result_cache)
+        view = events.create_materialized_view(QueryBuilder(events).select("status").sum("amount").group_by("status"))
+        cached.execute().fetchall()
+        cached.execute().fetchall()
+        events.add_row({"status": "paid", "amount": 5})
+        checks.append((cached.execute().fetchall(), result_cache.hits, len(view)))
+        checks.append(QueryBuilder(events).select("status").sum("amount").group_by("status").execute().fetchall())
+        
+        # A cursor read after its GROUP BY column switched from dictionary codes to plain text
+        cursor = QueryBuilder(events).select("status").count("*").group_by("status").execute()
+        events.add_rows({"status": f"status_{n}", "amount": n} for n in range(DICTIONARY_MAX_SIZE + 1))
+        checks.append(cursor.fetchmany(3))
+        
+        # Rows keep their values in a tuple, with the column layout shared between them
+        row = events.row_repository.row(0)
+        checks.append((row.get("status"), row.values, "amount" in events.column_repository))
+        
+        # Foreign key values given as text are stored with the type of the key they reference, so they join and filter as numbers
+        accounts = create_table("accounts", storage)
+        accounts.add_column("id", SQLDataType.INT, is_pk=True).add_column("owner", SQLDataType.TEXT)
+        accounts.add_rows([{"id": 1, "owner": "ann"}, {"id": 2, "owner": "bob"}])
+        payments = create_table("payments", storage)
+        payments.add_column("id", SQLDataType.INT, is_pk=True, auto_increment=True).add_foreign_key("account_id", accounts, "id")
+        payments.add_row({"account_id": "1"})
+        payments.add_rows([{"account_id": "2"}, {"account_id": "1"}])
+        checks.append(QueryBuilder(payments).select("id", "owner").join(accounts).where(account_id=1).execute().fetchall())
+        
+        # Saving and opening a table with more distinct TEXT values than dictionary codes can hold
+        events.add_rows({"status": f"email_{n}@example.com"} for n in range(70000))
+        with tempfile.TemporaryDirectory() as directory:
+            events.save(directory)
+            saved_events = Table.open(directory)
+            checks.append(QueryBuilder(saved_events).select("status").count("*").where(status="email_69999@example.com").group_by("status").execute().fetchall())
+            saved_events.close()
+            events.close()
+        results[storage] = checks
+        
+    print(results["columnar"])
+    print(results["row"] == results["columnar"])
+    print("\n")
+
 if __name__ == "__main__":
     test_query_builder()